@@ -34,6 +34,8 @@ if len(sys.argv)>1 and sys.argv[1] == 'compress-and-remove':
 # data is ready upon exiting)
 
 import collections
+import concurrent.futures
+import threading
 import signal
 import uuid
 import json
@@ -47,6 +49,11 @@ FRAME_FMT = 'frame%04d.png'
 CURRENT_FRAME_FILE = 'current_frame.png'
 BACKGROUND = (240, 235, 220)
 PEN = (20, 20, 20)
+MAX_SHARED_FRAME_STORE_BYTE_SIZE = 1*1024**3
+SHARED_FRAME_STORE_IDLE_SECONDS = 10*60 # entries not read for this long can be evicted from the store
+MAX_DAMAGE_LOG_SIZE = 16 # per frame, see Frame.add_damage()
+MAX_BACKGROUND_WORKERS = 4 # threads computing timeline thumbnails and prefetching frames, see BackgroundPool
+MAX_PREFETCHED_POSITIONS = 3 # positions ahead of the current one prefetched when scrubbing, see TimelineArea.prefetch()
 
 class CachedItem:
     def compute_key(self):
@@ -73,9 +80,14 @@ class CachedItem:
 
 # there are 2 reasons to evict a cached item:
 # * no more room in the cache - evict the least recently used items until there's room
-# * the cached item has no chance to be useful - eg it was computed from a deleted or
-#   since-edited frame - this is done by collect_garbage() and assisted by update_id()
-#   and delete_id()
+# * the cached item has no chance to be useful - eg it was computed from a since-edited
+#   frame - this is done by collect_garbage() and assisted by update_id() and delete_id()
+#
+# an ID passed to delete_id() is "retired" rather than forgotten - its objects are typically gone
+# because the user switched to another clip, and they come back with the same IDs and the same
+# pixels if the user switches back (which is common.) items computed from retired IDs are
+# "dormant" - they're kept, up to MAX_DORMANT_CACHE_BYTE_SIZE, and become live again when
+# revive_id() is called for all of their IDs.
 class Cache:
     class Miss:
         pass
@@ -83,6 +95,7 @@ class Cache:
     def __init__(self):
         self.key2value = collections.OrderedDict()
         self.id2version = {}
+        self.retired_id2version = {}
         self.debug = False
         self.gc_iter = 0
         self.last_check = {}
@@ -101,22 +114,33 @@ class Cache:
                 # numpy array
                 return reduce(lambda x,y: x*y, value.shape)
             except:
-                return 0
+                return getattr(value, 'nbytes', 0)
     def lock(self): self.locked = True
     def unlock(self): self.locked = False
+    def worker_thread(self):
+        # worker threads (see BackgroundPool) only read the cache; all updates happen in the main thread
+        return threading.current_thread() is not threading.main_thread()
+    def take(self, key):
+        '''removes the value cached under key (as returned by CachedItem.compute_key()) from the cache and returns it,
+        or None if it's not cached. this is for updating a value computed from an older version of an object in place'''
+        if self.worker_thread():
+            return None
+        value = self.key2value.pop((key, (IWIDTH, IHEIGHT)), None)
+        if value is not None:
+            self.cache_size -= self.size(value)
+        return value
     def fetch(self, cached_item): return self.fetch_kv(cached_item)[1]
     def fetch_kv(self, cached_item):
         key = (cached_item.compute_key(), (IWIDTH, IHEIGHT))
         value = self.key2value.get(key, Cache.MISS)
+        if self.worker_thread():
+            return key[0], (value if value is not Cache.MISS else cached_item.compute_value())
         if value is Cache.MISS:
             value = cached_item.compute_value()
-            vsize = self.size(value)
-            self.computed_bytes += vsize
+            self.computed_bytes += self.size(value)
             if self.locked:
                 return key[0], value
-            self.cache_size += vsize
-            self._evict_lru_as_needed()
-            self.key2value[key] = value
+            self.store(key[0], value)
         else:
             self.key2value.move_to_end(key)
             self.cached_bytes += self.size(value)
@@ -128,6 +152,21 @@ class Cache:
                 self.last_check[key] = self.gc_iter
         return key[0], value
 
+    def get(self, key):
+        '''returns the value cached under key (as returned by CachedItem.compute_key()), or None'''
+        value = self.key2value.get((key, (IWIDTH, IHEIGHT)))
+        if value is not None:
+            self.key2value.move_to_end((key, (IWIDTH, IHEIGHT)))
+            self.cached_bytes += self.size(value)
+        return value
+    def store(self, key, value):
+        old_value = self.key2value.pop((key, (IWIDTH, IHEIGHT)), None)
+        if old_value is not None:
+            self.cache_size -= self.size(old_value)
+        self.cache_size += self.size(value)
+        self._evict_lru_as_needed()
+        self.key2value[(key, (IWIDTH, IHEIGHT))] = value
+
     def _evict_lru_as_needed(self):
         while self.cache_size > MAX_CACHE_BYTE_SIZE or len(self.key2value) > MAX_CACHED_ITEMS:
             key, value = self.key2value.popitem(last=False)
@@ -137,22 +176,53 @@ class Cache:
         self.id2version[id] = version
     def delete_id(self, id):
         if id in self.id2version:
-            del self.id2version[id]
+            version = self.id2version.pop(id)
+            if id is not None:
+                self.retired_id2version[id] = version
+    def revive_id(self, id):
+        '''returns the version an object with this ID should start at when (re)created'''
+        if id is None:
+            return 0
+        live_version = self.id2version.get(id)
+        if live_version is not None:
+            # another live object has this ID - don't let its cached items be mistaken for ours
+            return live_version + 1
+        return self.retired_id2version.pop(id, 0)
     def stale(self, key):
         id2version, _ = key[0]
         for id, version in id2version:
             current_version = self.id2version.get(id)
+            if current_version is None:
+                current_version = self.retired_id2version.get(id)
             if current_version is None or version < current_version:
                 #print('stale',id,version,current_version)
                 return True
         return False
+    def dormant(self, key):
+        id2version, _ = key[0]
+        for id, version in id2version:
+            if id not in self.id2version:
+                return True
+        return False
     def collect_garbage(self):
         orig = len(self.key2value)
         orig_size = self.cache_size
-        for key, value in list(self.key2value.items()):
-            if self.stale(key):
-                del self.key2value[key]
-                self.cache_size -= self.size(value)
+        dormant_size = 0
+        referenced_ids = set()
+        # go from the most to the least recently used item so that we keep the most recently used dormant items
+        for key, value in reversed(list(self.key2value.items())):
+            if not self.stale(key):
+                if not self.dormant(key):
+                    continue
+                dormant_size += self.size(value)
+                if dormant_size <= MAX_DORMANT_CACHE_BYTE_SIZE:
+                    referenced_ids.update([id for id, version in key[0][0]])
+                    continue
+            del self.key2value[key]
+            self.cache_size -= self.size(value)
+        # a retired ID not referenced by any cached item can be forgotten - its objects can start from version 0
+        # if they come back since nothing could be mistaken for having been computed from them
+        self.retired_id2version = dict([(id, version) for id, version in self.retired_id2version.items() if id in referenced_ids])
         #print('gc',orig,orig_size,'->',len(self.key2value),self.cache_size,'computed',self.computed_bytes,'cached',self.cached_bytes,tdiff())
         self.gc_iter += 1
         self.computed_bytes = 0
@@ -160,6 +230,98 @@ class Cache:
 
 cache = Cache()
 
+# a cache miss when drawing the timeline means compositing and scaling all the layers of a frame; when scrubbing into
+# frames we haven't shown yet, doing this for every thumbnail in the main thread stalls the UI. instead, the timeline
+# shows a placeholder and asks BackgroundPool to compute the thumbnail in a worker thread [which runs in parallel
+# with the main thread for the most part, since cv2 and numpy release the GIL], and is redrawn when it's ready.
+#
+# the workers read the cache but never update it (a worker's cache misses are simply computed), and they
+# read the movie while the main thread might be editing it; a value is only stored if the key computed from the
+# current state of the movie is still the one the value was requested with (so it wasn't computed from a mix of
+# the old and the new state)
+#
+# the pool is also used to prefetch the frames we're likely to show next when scrubbing (see TimelineArea.prefetch()).
+# prefetched values don't cause a redraw when they arrive, and prefetches which didn't start running yet
+# are cancelled when the scrubbing changes course
+class BackgroundPool:
+    def __init__(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(MAX_BACKGROUND_WORKERS, os.cpu_count() or 1))
+        self.pending = {} # key -> (current_key, future, prefetch, store)
+        self.done = collections.deque() # (key, future) of the futures done since the last collect()
+        self.on_done = lambda: None # called when a future is done, in the worker thread; should have collect() called
+
+    def _future_done(self, key, future):
+        self.done.append((key, future))
+        self.on_done()
+
+    def fetch(self, cached_item, current_key, prefetch=False, store=None):
+        '''returns the cached value, or None if it's not cached yet (in which case it's computed in the background.)
+        current_key() should return cached_item's key computed from the state of the movie when it's called.
+        store(key, value) is called instead of storing the value in the cache when it's computed'''
+        key = cached_item.compute_key()
+        value = cache.get(key) if store is None else None
+        if value is None:
+            if key not in self.pending:
+                future = self.executor.submit(cached_item.compute_value)
+                self.pending[key] = (current_key, future, prefetch, store if store is not None else cache.store)
+                future.add_done_callback(lambda future, key=key: self._future_done(key, future))
+            elif not prefetch:
+                current_key, future, _, store = self.pending[key]
+                self.pending[key] = (current_key, future, False, store) # someone is waiting for it now
+        return value
+
+    def cancel_prefetches(self):
+        for _, future, prefetch, _ in self.pending.values():
+            if prefetch:
+                future.cancel() # does nothing if it's already running; collect() forgets cancelled futures
+
+    def take(self, key):
+        '''returns the value requested with key even if current_key() doesn't return key anymore (for values which
+        stay valid across some changes to the movie.) returns None if it wasn't requested, isn't computed yet or failed;
+        either way, the request is forgotten (and cancelled if it didn't start running), and the value isn't cached'''
+        pending = self.pending.pop(key, None)
+        if pending is None:
+            return None
+        _, future, _, _ = pending
+        if not future.done():
+            future.cancel()
+            return None
+        try:
+            return future.result()
+        except:
+            return None
+
+    def collect(self):
+        '''stores the values computed by the workers in the cache (or passes them to the store function given to fetch());
+        returns True if there were any not prefetched'''
+        stored = False
+        while self.done:
+            key, future = self.done.popleft()
+            if self.pending.get(key, (None, None, None, None))[1] is not future:
+                continue # taken (see take())
+            current_key, future, prefetch, store = self.pending.pop(key)
+            try:
+                value = future.result()
+                if current_key() != key:
+                    continue
+            except:
+                # the movie was edited under the worker's feet in a way making it fail; the thumbnail will be requested
+                # again if it's still needed
+                continue
+            store(key, value)
+            stored = stored or not prefetch
+        return stored
+
+background_pool = BackgroundPool()
+
+def worker_copy(surface):
+    '''returns a copy of the surface in a BackgroundPool worker, and the surface itself in the main thread. a surface
+    is locked while its pixels are accessed as an array, and a locked surface can't be blitted - so a worker holding
+    such an array while it releases the GIL [in cv2 or tinylib] would break the main thread's blits of the surfaces
+    they share (frames and cached values.) workers thus only access the pixels of their own surfaces, and copy
+    the shared ones first (copying a surface doesn't lock it)'''
+    return surface.copy() if cache.worker_thread() else surface
+
 def fit_to_resolution(surface):
     w,h = surface.get_width(), surface.get_height()
     if w == IWIDTH and h == IHEIGHT:
@@ -183,6 +345,141 @@ def load_image(fname):
     pg.surfarray.pixels_alpha(ret)[:] = pg.surfarray.pixels_alpha(s)
     return ret
 
+import hashlib
+import time
+import tempfile
+import stat
+
+# decoded frame surfaces shared between the GUI and the export processes. the PNGs of a clip are decoded
+# when it's opened, and again by the export process after it's closed (and by the GUI if it's reopened later.)
+# reading the raw pixels stored by whoever decoded a PNG first is ~10x faster than decoding it again.
+#
+# the store is a directory of raw pixel files, in shared memory where we have it (/dev/shm.) an entry is named after
+# the path, modification time and size of the file it was decoded from, so an edited frame [which is saved into a new file]
+# can't hit a stale entry. the store is best-effort - any error in reading or writing it is treated as a miss.
+# the directory is per-user and only accessible to its owner - we'd otherwise load [and later save] pixels planted
+# by another user; if it's not ours, we don't use the store at all.
+#
+# when the store is full, we only evict entries nobody read for SHARED_FRAME_STORE_IDLE_SECONDS, and otherwise
+# stop adding entries - decoding a clip bigger than the store from the first frame to the last would evict everything
+# we'd later need with LRU eviction, since we read the frames in the same order. idle entries are also evicted when
+# we start, and every process removes the entries it stored when it exits (the GUI does it after its exports
+# are done), so that the store doesn't keep shared memory [which is RAM] once nobody uses it. (entries stored by
+# other processes might still be used by them, and are left to be evicted when they're idle)
+class SharedFrameStore:
+    def __init__(self):
+        shm = '/dev/shm'
+        self.dir = self._private_dir(os.path.join(shm if os.path.isdir(shm) else tempfile.gettempdir(), 'tinymation-frames'))
+        # the size of the entries as of the last time we looked, plus those we stored since [other processes
+        # store and evict entries too, so we look again before evicting]
+        self.size = 0
+        self.stored = {} # path -> size of the entries we stored
+        self.evict()
+
+    def _private_dir(self, dir):
+        '''returns the per-user directory under the dir prefix, creating it if needed, or None if it can't be created
+        or someone else might write to it'''
+        if not hasattr(os, 'getuid'):
+            return dir # on Windows, the temp dir is per-user
+        dir = f'{dir}-{os.getuid()}'
+        try:
+            os.makedirs(dir, mode=0o700, exist_ok=True)
+            st = os.lstat(dir)
+        except OSError:
+            return None
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+            return None
+        return dir
+
+    def _path(self, fname):
+        if self.dir is None:
+            raise OSError('no shared frame store')
+        st = os.stat(fname)
+        key = f'{os.path.realpath(fname)}:{st.st_mtime_ns}:{st.st_size}'
+        return os.path.join(self.dir, hashlib.sha1(key.encode()).hexdigest() + '.raw')
+
+    def _header(self, surface):
+        return np.array([surface.get_width(), surface.get_height(), surface.get_pitch()] + list(surface.get_masks()), dtype=np.uint32).tobytes()
+
+    def load(self, fname):
+        '''returns the surface decoded from fname if it's in the store, None otherwise'''
+        try:
+            path = self._path(fname)
+            with open(path, 'rb') as f:
+                header = f.read(7*4)
+                width, height = np.frombuffer(header, dtype=np.uint32)[:2]
+                surface = pg.Surface((int(width), int(height)), pg.SRCALPHA)
+                if header != self._header(surface):
+                    return None
+                pixels = surface.get_view('1')
+                complete = f.readinto(pixels) == pixels.length
+                del pixels
+            os.utime(path) # for eviction
+            return surface if complete else None
+        except (OSError, ValueError):
+            return None
+
+    def store(self, fname, surface):
+        try:
+            path = self._path(fname)
+            header = self._header(surface)
+            nbytes = len(header) + surface.get_height() * surface.get_pitch()
+            if os.path.exists(path) or not self._make_room(nbytes):
+                return
+            tmp = f'{path}.{os.getpid()}.tmp' # other processes might write the same entry
+            with open(tmp, 'wb') as f:
+                f.write(header)
+                f.write(surface.get_view('1'))
+            os.replace(tmp, path)
+            self.size += nbytes
+            self.stored[path] = nbytes
+        except OSError:
+            pass
+
+    def _make_room(self, nbytes):
+        if self.size + nbytes <= MAX_SHARED_FRAME_STORE_BYTE_SIZE:
+            return True
+        self.evict(room=nbytes)
+        return self.size + nbytes <= MAX_SHARED_FRAME_STORE_BYTE_SIZE
+
+    def evict(self, idle_seconds=SHARED_FRAME_STORE_IDLE_SECONDS, room=None):
+        '''removes the entries nobody read for idle_seconds, least recently read first - all of them, or only as many
+        as it takes to make room for this many bytes'''
+        try:
+            dir_entries = [e for e in os.scandir(self.dir) if e.name.endswith('.raw')] if self.dir is not None else []
+        except OSError:
+            dir_entries = []
+        entries = []
+        for e in dir_entries:
+            try:
+                st = e.stat()
+            except OSError:
+                continue # evicted by another process
+            entries.append((st.st_mtime, st.st_size, e.path))
+        self.size = sum([size for _, size, _ in entries])
+        idle_since = time.time() - idle_seconds
+        for mtime, size, path in sorted(entries):
+            if mtime > idle_since or (room is not None and self.size + room <= MAX_SHARED_FRAME_STORE_BYTE_SIZE):
+                break
+            try:
+                os.unlink(path)
+                self.size -= size
+                self.stored.pop(path, None)
+            except OSError:
+                pass
+
+    def remove_stored(self):
+        '''removes the entries we stored'''
+        for path, size in self.stored.items():
+            try:
+                os.unlink(path)
+                self.size -= size
+            except OSError:
+                pass # evicted by another process
+        self.stored = {}
+
+shared_frames = SharedFrameStore()
+
 class Frame:
     def __init__(self, dir, layer_id=None, frame_id=None, read_pixels=True):
         self.dir = dir
@@ -206,8 +503,12 @@ class Frame:
         # going up instead of back down upon undo, or going up by more than 1 upon a single
         # editing operation. the version number is used for knowing when a cache hit
         # would produce stale data; if we occasionally evict valid data it's not as bad
-        # as for hits to occasionally return stale data
-        self.version = 0
+        # as for hits to occasionally return stale data. when a frame is reloaded [eg when switching
+        # back to a clip], it continues from the version it had when it was unloaded so the cached
+        # data computed from it is still usable
+        self.version = cache.revive_id(self.cache_id())
+        self.damage_log = [] # see add_damage()
+        self.retired = False
         self.hold = False
 
         cache.update_id(self.cache_id(), self.version)
@@ -215,13 +516,25 @@ class Frame:
         self.compression_subprocess = None
 
     def __del__(self):
+        if not self.retired:
+            cache.delete_id(self.cache_id())
+
+    def retire(self):
+        # called when the clip is closed; the Frame object might outlive this point
+        # [it's often only freed by the cyclic GC], and by then the frame might be reloaded
+        # by a new Frame object with the same ID which we mustn't delete from the cache
         cache.delete_id(self.cache_id())
+        self.retired = True
 
     def read_pixels(self):
         for surf_id in self.surf_ids():
             for fname in self.filenames_png_bmp(surf_id):
                 if os.path.exists(fname):
-                    setattr(self,surf_id,fit_to_resolution(load_image(fname)))
+                    surface = shared_frames.load(fname)
+                    if surface is None:
+                        surface = load_image(fname)
+                        shared_frames.store(fname, surface)
+                    setattr(self,surf_id,fit_to_resolution(surface))
                     break
 
     def del_pixels(self):
@@ -253,6 +566,27 @@ class Frame:
         self.version += 1
         cache.update_id(self.cache_id(), self.version)
 
+    def add_damage(self, since_version, region):
+        '''records that the pixels at the current version differ from the pixels at since_version only inside
+        region (xmin, ymin, xmax, ymax - exclusive), so cached items computed from since_version can be patched
+        rather than recomputed'''
+        self.damage_log = self.damage_log[-(MAX_DAMAGE_LOG_SIZE-1):] + [(since_version, self.version, region)]
+
+    def damage_since(self, version):
+        '''returns the region outside of which the pixels didn't change since version, or None if we don't know it'''
+        region = (IWIDTH, IHEIGHT, 0, 0)
+        for since, upto, (xmin, ymin, xmax, ymax) in self.damage_log:
+            if since != version:
+                continue
+            if xmax > xmin and ymax > ymin:
+                region = min(region[0], xmin), min(region[1], ymin), max(region[2], xmax), max(region[3], ymax)
+            version = upto
+        return region if version == self.version else None
+
+    def damaged_versions(self):
+        '''the versions damage_since() might know about, most recent first'''
+        return list(dict.fromkeys([since for since, _, _ in reversed(self.damage_log)]))
+
     def surf_ids(self): return ['lines','color']
     def get_width(self): return IWIDTH
     def get_height(self): return IHEIGHT
@@ -279,12 +613,95 @@ class Frame:
             return empty.subsurface(0, 0, width, height)
 
         with thumb_timer:
+            if roi is None or tuple(roi) == (0, 0, IWIDTH, IHEIGHT):
+                width, height = scaled_size(IWIDTH, IHEIGHT, width, height, inv_scale)
+                level = halvings(IWIDTH, IHEIGHT, width, height)
+                if level:
+                    return scale_image(self.mip(level), width, height)
             return scale_image(self.surface(roi), width, height, inv_scale)
             # note that for a small ROI it's faster to blit lines onto color first, and then scale;
             # for a large ROI, it's faster to scale first and then blit the smaller number of pixels.
             # however this produces ugly artifacts where lines & color are eroded and you see through
             # both into the layer below, so we don't do it
 
+    def mip(self, level):
+        '''the frame halved level times, the way scale_image() halves it before resizing it to a small size - so scaling
+        a mip level produces the same pixels as scaling the frame. the levels are cached, and when the frame is edited,
+        they're patched in the changed region rather than recomputed'''
+        frame = self
+        class CachedMip(CachedItem):
+            def compute_key(_):
+                return (frame.cache_id_version(),), ('mip', level)
+            def compute_value(_):
+                mip = frame._patched_mip(level, _.compute_key())
+                if mip is not None:
+                    return mip
+                parent = frame.surface() if level == 1 else frame.mip(level-1)
+                return scale_image(parent, parent.get_width()//2, parent.get_height()//2)
+        return cache.fetch(CachedMip())
+
+    def _patched_mip(self, level, key):
+        # halving an image with even dimensions averages 2x2 blocks, so a pixel at this level depends on a 2**level
+        # sized block of the frame's pixels and nothing else. when it's not the case, the level is small enough
+        # to recompute
+        pw, ph = IWIDTH, IHEIGHT
+        for _ in range(level):
+            if pw % 2 or ph % 2:
+                return None
+            pw, ph = pw//2, ph//2
+        id2version, computation = key
+        (cache_id, version), = id2version
+        for old_version in self.damaged_versions():
+            region = self.damage_since(old_version)
+            if region is None:
+                continue
+            mip = cache.take((((cache_id, old_version),), computation))
+            if mip is None:
+                continue
+            xmin, ymin, xmax, ymax = region
+            block = 2**level
+            xmin, ymin = max(0, xmin//block), max(0, ymin//block)
+            xmax, ymax = min(pw, (xmax+block-1)//block), min(ph, (ymax+block-1)//block)
+            if xmax > xmin and ymax > ymin:
+                parent_roi = (xmin*2, ymin*2, (xmax-xmin)*2, (ymax-ymin)*2)
+                parent = self.surface(parent_roi) if level == 1 else self.mip(level-1).subsurface(parent_roi)
+                tiles = scale_image(parent, xmax-xmin, ymax-ymin)
+                for pixels in pg.surfarray.pixels3d, pg.surfarray.pixels_alpha:
+                    pixels(mip)[xmin:xmax, ymin:ymax] = pixels(tiles)
+            return mip
+        return None
+
+    def patch_thumbnail(self, thumbnail, region, roi, inv_scale, step):
+        '''updates thumbnail(roi=roi, inv_scale=inv_scale) computed from an older version of the pixels which differ
+        from the current ones only inside region. like DrawingArea.draw_region(), this relies on roi and step being
+        aligned s.t. scaling a step-aligned sub-region of the ROI produces the same pixels as the sub-region of the
+        scaled ROI, except near the sub-region boundaries'''
+        xmin, ymin, xmax, ymax = region
+        if xmax <= xmin or ymax <= ymin:
+            return
+        rx, ry, rw, rh = roi
+        def align_down(n): return (n // step) * step
+        def align_up(n): return ((n + step - 1) // step) * step
+        # add a step of margin around the region for the scaling to read the same neighboring pixels as when scaling the ROI
+        xmin = max(align_down(xmin) - step, rx)
+        ymin = max(align_down(ymin) - step, ry)
+        xmax = min(align_up(xmax) + step, rx+rw)
+        ymax = min(align_up(ymax) + step, ry+rh)
+        if xmax <= xmin or ymax <= ymin:
+            return # the change is outside the ROI
+
+        tiles = self.thumbnail(roi=(xmin, ymin, xmax-xmin, ymax-ymin), inv_scale=inv_scale)
+        w, h = tiles.get_width(), tiles.get_height()
+        x, y = round((xmin-rx)*inv_scale), round((ymin-ry)*inv_scale)
+        # don't copy the margins (they have scaling artifacts) unless they're at the ROI boundaries
+        margin = round(step*inv_scale)
+        left = margin if xmin > rx else 0
+        bottom = margin if ymin > ry else 0
+        right = w - (margin if xmax < rx+rw else 0)
+        top = h - (margin if ymax < ry+rh else 0)
+        for pixels in pg.surfarray.pixels3d, pg.surfarray.pixels_alpha:
+            pixels(thumbnail)[x+left:x+right, y+bottom:y+top] = pixels(tiles)[left:right, bottom:top]
+
     def filenames_png_bmp(self,surface_id):
         fname = f'{self.id}-{surface_id}.'
         if self.layer_id:
@@ -319,6 +736,41 @@ class Frame:
     def cache_id(self): return (self.id, self.layer_id) if not self.empty() else None
     def cache_id_version(self): return self.cache_id(), self.version
 
+    def take_solid_lines_mask(self):
+        '''returns the mask of the pixels where the lines are solid (alpha 255) - the lines the eraser floods color
+        up to. the eraser modifies the mask as it goes, and so it takes the mask out of the cache rather than computing
+        it anew for every stroke; once it updates the mask to match the new pixels, it gives it back with
+        store_solid_lines_mask()'''
+        mask = cache.take(((self.cache_id_version(),), 'solid lines mask'))
+        if mask is None:
+            mask = pg.surfarray.pixels_alpha(self.surf_by_id('lines')) == 255
+        return mask
+
+    def store_solid_lines_mask(self, mask):
+        cache.store(((self.cache_id_version(),), 'solid lines mask'), mask)
+
+    def regions(self, background=False, key=False):
+        '''the FrameRegions of the lines if they're cached, or None. with background=True, they're computed
+        by BackgroundPool if they're not cached'''
+        frame = self
+        class CachedRegions(CachedItem):
+            def compute_key(_):
+                return (frame.cache_id_version(),), 'regions'
+            def compute_value(_):
+                # we work on a copy since the pixel array of the frame's surface would keep it locked (and unusable
+                # by the main thread) while we compute
+                return FrameRegions(pg.surfarray.pixels_alpha(frame.surf_by_id('lines').copy()))
+        if key:
+            return CachedRegions().compute_key()
+        if background:
+            return background_pool.fetch(CachedRegions(), lambda: CachedRegions().compute_key(), prefetch=True)
+        return cache.get(CachedRegions().compute_key())
+
+    def store_regions(self, regions):
+        '''caches regions computed from an older version of the frame for the current version - when only the color
+        was changed since (the regions only depend on the lines)'''
+        cache.store(((self.cache_id_version(),), 'regions'), regions)
+
     def fit_to_resolution(self):
         if self.empty():
             return
@@ -496,9 +948,12 @@ class MovieData:
                 surfaces.append(f.surf_by_id('lines'))
             else:
                 surfaces.append(movie.get_thumbnail(pos, width, height, transparent_single_layer=self.layers.index(layer), roi=roi, inv_scale=inv_scale))
-        s.blits([(surface, (0, 0), (0, 0, s.get_width(), s.get_height())) for surface in surfaces])
+        self._blit_surfaces(s, surfaces)
         return s
 
+    def _blit_surfaces(self, s, surfaces):
+        s.blits([(surface, (0, 0), (0, 0, s.get_width(), s.get_height())) for surface in surfaces])
+
 
 # a supposed advantage of this verbose method of writing MP4s using PyUV over "just" using imageio
 # is that `pip install av` installs ffmpeg libraries so you don't need to worry
@@ -636,6 +1091,7 @@ if len(sys.argv)>1 and sys.argv[1] == 'export':
         import traceback
         traceback.print_exc()
     finally:
+        shared_frames.remove_stored()
         sys.exit()
 
 def get_last_modified(filenames):
@@ -716,8 +1172,8 @@ pg = pygame
 pg.init()
 
 from PySide6.QtWidgets import QApplication, QWidget, QFileDialog, QLineEdit, QVBoxLayout, QPushButton, QHBoxLayout, QDialog, QMessageBox, QColorDialog
-from PySide6.QtGui import QImage, QPainter, QPen, QColor, QGuiApplication, QCursor, QPixmap
-from PySide6.QtCore import Qt, QPoint, QEvent, QTimer, QCoreApplication, QEventLoop, QSize
+from PySide6.QtGui import QImage, QPainter, QPen, QColor, QGuiApplication, QCursor, QPixmap, QRegion
+from PySide6.QtCore import Qt, QPoint, QEvent, QTimer, QCoreApplication, QEventLoop, QSize, QRect, Signal
 
 app = QApplication(sys.argv)
 
@@ -739,7 +1195,25 @@ def pgsurf2qtimage(src, dst):
 #screen = pygame.display.set_mode((350, 800), pygame.RESIZABLE)
 #screen = pygame.display.set_mode((1200, 350), pygame.RESIZABLE)
 #screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
-screen = pg.Surface((1920, 1200), pg.SRCALPHA)#pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+# the screen surface is created over the memory of the QImage the widget paints from, so what we draw
+# lands in the image without copying [the QImage has the same ARGB layout as a SRCALPHA surface]
+screen_image = QImage(1920, 1200, QImage.Format.Format_RGB32)
+screen = pg.image.frombuffer(screen_image.bits(), (screen_image.width(), screen_image.height()), 'BGRA')#pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
+
+class ScreenDamage:
+    '''the rectangles of screen pixels changed since the widget last repainted them'''
+    def __init__(self):
+        self.region = QRegion()
+    def add(self, rect=None):
+        '''rect is (left, bottom, width, height) in screen coordinates; None means the whole screen'''
+        self.region = self.region.united(QRect(*pg.Rect(rect if rect is not None else screen.get_rect())))
+    def take(self):
+        '''returns the damaged QRegion, or None if nothing changed'''
+        region = self.region
+        self.region = QRegion()
+        return region if not region.isEmpty() else None
+
+screen_damage = ScreenDamage()
 
 screen.fill(BACKGROUND)
 #pygame.display.flip()
@@ -760,10 +1234,20 @@ WIDTH = 3 # the smallest width where you always have a pure pen color rendered a
 MEDIUM_ERASER_WIDTH = 5*WIDTH
 BIG_ERASER_WIDTH = 20*WIDTH
 PAINT_BUCKET_WIDTH = 3*WIDTH
+# mouse strokes are smoothed as they're drawn: whenever SMOOTHING_STEP new points come in, a spline is fitted to them
+# together with SMOOTHING_OVERLAP points before them and the last SMOOTHING_LAG points, which are left unsmoothed until
+# more points come in (see PenTool.smooth_stroke_part().) without INCREMENTAL_SMOOTHING, the whole stroke is smoothed
+# when the mouse button is released
+INCREMENTAL_SMOOTHING = True
+SMOOTHING_STEP = 16
+SMOOTHING_OVERLAP = 8
+SMOOTHING_LAG = 8
 CURSOR_SIZE = int(screen.get_width() * 0.055)
 MAX_HISTORY_BYTE_SIZE = 1*1024**3
 MAX_CACHE_BYTE_SIZE = 1*1024**3
+MAX_DORMANT_CACHE_BYTE_SIZE = 256*1024**2 # out of MAX_CACHE_BYTE_SIZE - items of recently closed clips
 MAX_CACHED_ITEMS = 2000
+MAX_PLAYBACK_RING_BYTE_SIZE = 512*1024**2 # frames beyond this are rendered during playback
 
 print('clips read from, and saved to',WD)
 
@@ -798,6 +1282,11 @@ class Timer:
         if len(self.history) > Timer.CALL_HISTORY:
             del self.history[0]
         return took * Timer.SCALE
+    def record(self, start_ns):
+        # measures the time since start_ns rather than since start() - for things which started before we could
+        # call start(), such as the arrival of an input event
+        self.start_ns = start_ns
+        return self.stop()
     def show(self):
         scale = Timer.SCALE
         if self.calls>1:
@@ -840,12 +1329,16 @@ movie_list_area_draw_timer = timers.add('MovieListArea.draw', indent=1)
 pen_down_timer = timers.add('PenTool.on_mouse_down')
 pen_move_timer = timers.add('PenTool.on_mouse_move')
 pen_up_timer = timers.add('PenTool.on_mouse_up')
+pen_paint_timer = timers.add('PenTool.paint_queued_points')
+pen_smooth_timer = timers.add('PenTool.smooth_stroke_part', indent=1)
 pen_draw_lines_timer = timers.add('drawLines', indent=1)
 pen_suggestions_timer = timers.add('pen suggestions', indent=1)
 eraser_timer = timers.add('eraser',indent=1)
 pen_fading_mask_timer = timers.add('fading_mask', indent=1)
+motion_wait_timer = timers.add('queued motion wait')
+motion_batch_timer = timers.add('queued motion handling')
+motion_latency_timer = timers.add('motion to paint latency')
 paint_bucket_timer = timers.add('PaintBucketTool.fill')
-bucket_points_near_line_timer = timers.add('integer_points_near_line_segment', indent=1)
 bucket_flood_fill_timer = timers.add('flood_fill_color_based_on_lines', indent=1)
 timeline_down_timer = timers.add('TimelineArea.on_mouse_down')
 timeline_move_timer = timers.add('TimelineArea.on_mouse_move')
@@ -898,24 +1391,122 @@ import numpy.ctypeslib as npct
 import ctypes
 tinylib = npct.load_library('tinylib','.')
 
-tinylib.brush_init_paint.argtypes = [ctypes.c_double]*5 + [ctypes.c_int, ctypes.c_void_p] + [ctypes.c_int]*4
+tinylib.brush_init_paint.argtypes = [ctypes.c_void_p] + [ctypes.c_double]*2 + [ctypes.c_int, ctypes.c_void_p] + [ctypes.c_int]*4
 tinylib.brush_init_paint.restype = ctypes.c_void_p
-tinylib.brush_paint.argtypes = [ctypes.c_void_p]*3 + [ctypes.c_double]*2 + [ctypes.c_void_p]
+tinylib.brush_paint.argtypes = [ctypes.c_void_p]*2 + [ctypes.c_double, ctypes.c_void_p]
+tinylib.brush_paint_many.argtypes = [ctypes.c_void_p]*2 + [ctypes.c_int, ctypes.c_double] + [ctypes.c_void_p]*2
 tinylib.brush_end_paint.argtypes = [ctypes.c_void_p]*2
 tinylib.brush_flood_fill_color_based_on_mask.argtypes = [ctypes.c_void_p]*3 + [ctypes.c_int]*5
 tinylib.fitpack_parcur.argtypes = [ctypes.c_void_p]*2 + [ctypes.c_int]*3 + [ctypes.c_double] + [ctypes.c_void_p]*3
+tinylib.blend_layers.argtypes = [ctypes.c_void_p] + [ctypes.c_int]*3 + [ctypes.c_void_p]*3 + [ctypes.c_int]
+tinylib.blend_color.argtypes = [ctypes.c_void_p] + [ctypes.c_int]*6
+tinylib.update_mask_alpha.argtypes = [ctypes.c_void_p, ctypes.c_int]*3 + [ctypes.c_int]*3
+tinylib.blend_alpha_masks.argtypes = [ctypes.c_void_p] + [ctypes.c_int]*3 + [ctypes.c_void_p]*3 + [ctypes.c_int]
+tinylib.flood_fill_color_based_on_mask_near_segment.argtypes = [ctypes.c_void_p]*2 + [ctypes.c_int]*4 + [ctypes.c_void_p] + [ctypes.c_int]*3 + [ctypes.c_double]*5
+tinylib.fill_color_regions_near_segment.argtypes = [ctypes.c_void_p] + [ctypes.c_int]*3 + [ctypes.c_void_p, ctypes.c_int] + [ctypes.c_void_p]*4 + [ctypes.c_int] + [ctypes.c_double]*5
 
 def rgba_array(surface):
     ptr, ystride, width, height, bgr = color_c_params(pg.surfarray.pixels3d(surface))
     buffer = ctypes.cast(ptr, ctypes.POINTER(ctypes.c_uint8 * (width * ystride * 4))).contents
     return np.ndarray((height,width,4), dtype=np.uint8, buffer=buffer, strides=(ystride, 4, 1)), bgr
 
+def blend_layers(dst, layers):
+    '''blits the layers onto dst at (0,0) in order, producing the same pixels as dst.blits() but in one pass over dst
+    [and in several threads for large surfaces]'''
+    dst_pixels = pg.surfarray.pixels3d(dst)
+    dptr, dstride, width, height, bgr = color_c_params(dst_pixels)
+    layer_pixels = []
+    ptrs = []
+    strides = []
+    alphas = []
+    layers = [worker_copy(layer) for layer in layers]
+    for layer in layers:
+        pixels = pg.surfarray.pixels3d(layer)
+        ptr, stride, lwidth, lheight, lbgr = color_c_params(pixels)
+        if lbgr != bgr or lwidth < width or lheight < height or not (layer.get_flags() & pg.SRCALPHA):
+            # not something we expect to happen, but blits() handles it so it's an easy fallback
+            del dst_pixels, layer_pixels, pixels
+            dst.blits([(layer, (0, 0), (0, 0, width, height)) for layer in layers])
+            return
+        layer_pixels.append(pixels)
+        ptrs.append(ptr.value)
+        strides.append(stride)
+        alpha = layer.get_alpha()
+        alphas.append(255 if alpha is None else alpha)
+    ptrs = np.array(ptrs, dtype=np.uintp)
+    strides = np.array(strides, dtype=np.int32)
+    alphas = np.array(alphas, dtype=np.int32)
+    tinylib.blend_layers(dptr, dstride, width, height, arr_base_ptr(ptrs), arr_base_ptr(strides), arr_base_ptr(alphas), len(layers))
+
+def blend_color(surface, color, alpha, keep_alpha=False):
+    '''blends the color over the surface in place, same as blitting a surface filled with color with the given surface alpha'''
+    ptr, stride, width, height, bgr = color_c_params(pg.surfarray.pixels3d(surface))
+    tinylib.blend_color(ptr, stride, width, height, make_color_int(tuple(color[:3])+(255,), bgr), alpha, 1 if keep_alpha else 0)
+
+def update_mask_alpha(alpha, lines, color, lines_lit):
+    '''alpha = np.minimum(255-color_alpha, alpha), followed by alpha = np.maximum(lines_alpha, alpha) if lines_lit,
+    in a single pass. alpha is a uint8 array with contiguous rows (indexed [x,y] like the alpha of the lines & color surfaces)'''
+    lines_alpha = pg.surfarray.pixels_alpha(worker_copy(lines))
+    color_alpha = pg.surfarray.pixels_alpha(worker_copy(color))
+    aptr, astride, width, height = greyscale_c_params(alpha, is_alpha=False)
+    lptr, lstride, _, _ = greyscale_c_params(lines_alpha)
+    cptr, cstride, _, _ = greyscale_c_params(color_alpha)
+    assert lines_alpha.shape == alpha.shape and color_alpha.shape == alpha.shape
+    tinylib.update_mask_alpha(aptr, astride, lptr, lstride, cptr, cstride, width, height, 1 if lines_lit else 0)
+
+def blend_alpha_masks(alphas, colors):
+    '''returns a surface with the colors blended one over the other, each with the per-pixel alpha in the respective
+    alpha array (of the kind update_mask_alpha() works on) - the same pixels as blitting surfaces filled with these
+    colors & alphas onto a copy of the first one would produce'''
+    width, height = alphas[0].shape
+    s = pg.Surface((width, height), pg.SRCALPHA)
+    ptr, stride, _, _, bgr = color_c_params(pg.surfarray.pixels3d(s))
+    ptrs = []
+    strides = []
+    for alpha in alphas:
+        aptr, astride, awidth, aheight = greyscale_c_params(alpha, is_alpha=False)
+        assert (awidth, aheight) == (width, height)
+        ptrs.append(aptr.value)
+        strides.append(astride)
+    ptrs = np.array(ptrs, dtype=np.uintp)
+    strides = np.array(strides, dtype=np.int32)
+    colors = np.array([make_color_int(tuple(color[:3])+(0,), bgr) for color in colors], dtype=np.uint32).view(np.int32)
+    tinylib.blend_alpha_masks(ptr, stride, width, height, arr_base_ptr(ptrs), arr_base_ptr(strides), arr_base_ptr(colors), len(alphas))
+    return s
+
+# BrushSample in brush.cpp
+brush_sample_dtype = np.dtype([('x', float), ('y', float), ('time', float), ('pressure', float)])
+
+def brush_samples(xs, ys, times, pressures=1):
+    '''an array of samples to pass to the brush; times are in ms, pressures are between 0 and 1 (1 for a mouse)'''
+    samples = np.empty(len(xs), dtype=brush_sample_dtype)
+    samples['x'] = xs
+    samples['y'] = ys
+    samples['time'] = times
+    samples['pressure'] = pressures
+    return samples
+
+def brush_init_paint(x, y, lineWidth, smoothDist, erase, lines, time=0, pressure=1):
+    # lines is either the alpha of a surface (as returned by pixels_alpha()) or an 8b array
+    xstride = lines.strides[0]
+    ptr, ystride, width, height = greyscale_c_params(lines, is_alpha=xstride==4)
+    sample = brush_samples([x], [y], [time], [pressure])
+    return tinylib.brush_init_paint(arr_base_ptr(sample), lineWidth, smoothDist, 1 if erase else 0, ptr, width, height, xstride, ystride)
+
+def brush_paint_spline(brush, xs, ys, region, start=0):
+    '''paints the points along a spline (7 ms apart as far as the brush smoothing is concerned, starting at the time 0
+    at which the brush is assumed to be initialized, or after the first start points if the spline is painted in parts)
+    in a single tinylib call; region gets the bounding box of everything painted'''
+    samples = brush_samples(xs, ys, np.arange(start+1, start+len(xs)+1) * 7)
+    tinylib.brush_paint_many(brush, arr_base_ptr(samples), len(samples), 1, region, None)
+
 # these are simple functions to test the assumptions regarding Surface numpy array layout
 def meshgrid_color(rgb): tinylib.meshgrid_color(*color_c_params(rgb))
 def meshgrid_alpha(alpha): tinylib.meshgrid_alpha(*greyscale_c_params(alpha))
 
 import cv2
 def cv2_resize_surface(src, dst, inv_scale=None):
+    src = worker_copy(src)
     iptr, istride, iwidth, iheight, ibgr = color_c_params(pg.surfarray.pixels3d(src))
     optr, ostride, owidth, oheight, obgr = color_c_params(pg.surfarray.pixels3d(dst))
     assert ibgr == obgr
@@ -930,6 +1521,12 @@ def cv2_resize_surface(src, dst, inv_scale=None):
 
     oattached = np.ndarray((oheight,owidth,4), dtype=np.uint8, buffer=obuffer, strides=(ostride, 4, 1))
 
+    cv2_resize(iattached, oattached, inv_scale)
+
+def cv2_resize(iattached, oattached, inv_scale=None):
+    iheight, iwidth = iattached.shape[:2]
+    oheight, owidth = oattached.shape[:2]
+
     if owidth < iwidth/2:
         method = cv2.INTER_AREA
     elif owidth > iwidth:
@@ -942,7 +1539,7 @@ def cv2_resize_surface(src, dst, inv_scale=None):
     else:
         cv2.resize(iattached, (owidth,oheight), oattached, interpolation=method)
 
-def scale_image(surface, width=None, height=None, inv_scale=None):
+def scaled_size(surface_width, surface_height, width=None, height=None, inv_scale=None):
     assert width or height or inv_scale
 
     if inv_scale is not None:
@@ -951,13 +1548,26 @@ def scale_image(surface, width=None, height=None, inv_scale=None):
         #                 saturate_cast<int>(ssize.height*inv_scale_y));
         # from fast_math.hpp:
         # template<> inline int saturate_cast<int>(double v)           { return cvRound(v); }
-        width = round(surface.get_width() * inv_scale)
-        height = round(surface.get_height() * inv_scale)
+        width = round(surface_width * inv_scale)
+        height = round(surface_height * inv_scale)
         
     if not height:
-        height = int(surface.get_height() * width / surface.get_width())
+        height = int(surface_height * width / surface_width)
     if not width:
-        width = int(surface.get_width() * height / surface.get_height())
+        width = int(surface_width * height / surface_height)
+
+    return width, height
+
+def halvings(surface_width, surface_height, width, height):
+    '''how many times scale_image() halves a surface before resizing it to width x height'''
+    n = 0
+    while width < surface_width//2 and height < surface_height//2:
+        surface_width, surface_height = surface_width//2, surface_height//2
+        n += 1
+    return n
+
+def scale_image(surface, width=None, height=None, inv_scale=None):
+    width, height = scaled_size(surface.get_width(), surface.get_height(), width, height, inv_scale)
 
     if width < surface.get_width()//2 and height < surface.get_height()//2:
         return scale_image(scale_image(surface, surface.get_width()//2, surface.get_height()//2), width, height)
@@ -969,6 +1579,25 @@ def scale_image(surface, width=None, height=None, inv_scale=None):
 
     return ret
 
+def scale_alpha(alpha, width=None, height=None, inv_scale=None):
+    '''scale_image() for a uint8 array indexed [x,y] with contiguous rows (like the arrays update_mask_alpha() works on)'''
+    surface_width, surface_height = alpha.shape
+    width, height = scaled_size(surface_width, surface_height, width, height, inv_scale)
+
+    if width < surface_width//2 and height < surface_height//2:
+        return scale_alpha(scale_alpha(alpha, surface_width//2, surface_height//2), width, height)
+
+    ret = np.empty((height, width), dtype=np.uint8)
+    cv2_resize(alpha.T, ret, inv_scale)
+    return ret.T
+
+def compose_surfaces(surfaces):
+    # the first surface is assumed to be opaque (like the bottom layers surface is), so blitting the rest onto its copy
+    # gives the same pixels as blitting them all onto the screen
+    s = surfaces[0].copy()
+    s.blits([(surface, (0, 0)) for surface in surfaces[1:]])
+    return s
+
 def minmax(v, minv, maxv):
     return min(maxv,max(minv,v))
 
@@ -1093,7 +1722,10 @@ class HistoryItem(HistoryItemBase):
     def __init__(self, surface_id, bbox=None):
         HistoryItemBase.__init__(self)
         self.surface_id = surface_id
+        self.frame_before_change = None
         if not bbox:
+            frame = movie.frame(movie.pos)
+            self.frame_before_change = (frame, frame.version) # for reporting the damage in optimize()
             surface = self.curr_surface().copy()
             self.minx = 10**9
             self.miny = 10**9
@@ -1160,6 +1792,7 @@ class HistoryItem(HistoryItemBase):
             if brect is None: # this can happen eg when drawing lines on an already-filled-with-lines area
                 self.saved_alpha = None
                 self.saved_rgb = None
+                self.report_damage((0, 0, 0, 0))
                 return
 
             self.minx, self.maxx, self.miny, self.maxy = brect
@@ -1168,6 +1801,16 @@ class HistoryItem(HistoryItemBase):
         if self.saved_rgb is not None:
             self.saved_rgb = self.saved_rgb[self.minx:self.maxx+1, self.miny:self.maxy+1].copy()
         self.optimized = True
+        self.report_damage(self.bounding_rect())
+
+    def report_damage(self, region):
+        # the change is complete once we're optimized - tell the frame where it was, so that the cached items computed
+        # from the frame before the change can be patched rather than recomputed
+        if self.frame_before_change is None:
+            return
+        frame, version = self.frame_before_change
+        self.frame_before_change = None
+        frame.add_damage(version, region)
 
     def __str__(self):
         return f'HistoryItem(pos={self.pos}, rect=({self.minx}, {self.miny}, {self.maxx}, {self.maxy}))'
@@ -1181,6 +1824,18 @@ class HistoryItemSet(HistoryItemBase):
     def __init__(self, items):
         HistoryItemBase.__init__(self)
         self.items = [item for item in items if item is not None]
+        # items changing the surfaces of a frame together are created one after another, each at the version following
+        # the previous item's (see HistoryItem.curr_surface()), so the damage they'd report separately doesn't chain
+        # (damage_since() the first item's version would only see the first item's damage.) we report the damage
+        # to the whole frame once instead, since the version before the first item
+        befores = [getattr(item, 'frame_before_change', None) for item in self.items]
+        befores = [before for before in befores if before is not None]
+        self.frame_before_change = None
+        if befores and all([frame is befores[0][0] for frame, _ in befores]):
+            self.frame_before_change = min(befores, key=lambda before: before[1])
+            for item in self.items:
+                if getattr(item, 'frame_before_change', None) is not None:
+                    item.frame_before_change = None
     def is_drawing_change(self):
         for item in self.items:
             if not item.is_drawing_change():
@@ -1209,6 +1864,11 @@ class HistoryItemSet(HistoryItemBase):
         for item in self.items:
             item.optimize(bbox)
         self.items = [item for item in self.items if not item.nop()]
+        if self.frame_before_change is not None:
+            frame, version = self.frame_before_change
+            self.frame_before_change = None
+            region = self.bounding_rect()
+            frame.add_damage(version, region if region is not None else (0, 0, 0, 0))
     def byte_size(self):
         return sum([item.byte_size() for item in self.items])
     def make_undone_changes_visible(self):
@@ -1234,6 +1894,7 @@ class LayoutElemBase:
     def on_mouse_down(self, x, y): pass
     def on_mouse_move(self, x, y): pass
     def on_mouse_up(self, x, y): pass
+    def on_mouse_moves_done(self): pass # called after handling a batch of queued mouse moves
     def on_history_timer(self): pass
 
 class Button(LayoutElemBase):
@@ -1278,6 +1939,11 @@ def curr_layer_locked():
         layout.drawing_area().fade_per_frame = 192/(FADING_RATE*3)
     return effectively_locked
 
+def union_bbox(bbox1, bbox2):
+    xmin1, ymin1, xmax1, ymax1 = bbox1
+    xmin2, ymin2, xmax2, ymax2 = bbox2
+    return (min(xmin1, xmin2), min(ymin1, ymin2), max(xmax1, xmax2), max(ymax1, ymax2))
+
 class PenTool(Button):
     def __init__(self, eraser=False, width=WIDTH):
         Button.__init__(self)
@@ -1287,10 +1953,17 @@ class PenTool(Button):
         self.width = width
         self.circle_width = (width//2)*2
         self.points = []
+        self.samples = [] # (x, y, time, pressure) for each of the points
+        self.queued_points = [] # samples not yet painted - see on_mouse_move()
         self.lines_array = None
         self.rect = np.zeros(4, dtype=np.int32)
         self.region = arr_base_ptr(self.rect)
         self.bbox = None
+        self.stroke_bbox = None # everything changed since on_mouse_down (self.bbox is reset when splitting the history)
+        self.pen_mask = None
+        self.smooth_incrementally = False
+        self.smoothed_lines = None # see smooth_stroke_part()
+        self.smooth_brush = None
         self.history_time_period = 1000
         self.timer = None
         self.patching = False
@@ -1306,11 +1979,12 @@ class PenTool(Button):
 
         tinylib.brush_flood_fill_color_based_on_mask(self.brush, color_ptr, mask_ptr, color_stride, mask_stride, 0, flood_code, new_color_value)
 
-    def init_brush(self, x, y, smoothDist=0):
-        ptr, ystride, width, height = greyscale_c_params(self.lines_array)
+    def make_brush(self, x, y, smoothDist=0, time=0, pressure=1, lines=None):
         lineWidth = 2.5 if self.width == WIDTH else self.width*layout.drawing_area().xscale
-        # FIXME use event timestamps
-        self.brush = tinylib.brush_init_paint(x, y, time.time_ns()*1000000, lineWidth, smoothDist, 1 if self.eraser else 0, ptr, width, height, 4, ystride)
+        return brush_init_paint(x, y, lineWidth, smoothDist, self.eraser, self.lines_array if lines is None else lines, time, pressure)
+
+    def init_brush(self, x, y, smoothDist=0, time=0, pressure=1):
+        self.brush = self.make_brush(x, y, smoothDist, time, pressure)
 
     def on_mouse_down(self, x, y):
         if curr_layer_locked():
@@ -1321,19 +1995,38 @@ class PenTool(Button):
             return
         pen_down_timer.start()
         self.points = []
+        self.samples = []
         self.bucket_color = None
+        if self.eraser: # taken before edit_curr_frame() changes the frame version
+            self.pen_mask = movie.frame(movie.pos).take_solid_lines_mask()
         self.lines_array = pg.surfarray.pixels_alpha(movie.edit_curr_frame().surf_by_id('lines'))
 
+        # the code in smooth_stroke_part() works for erasers ATM but it doesn't sound good to smooth "mice erasers"
+        # because while nominally pens and erasers are basically the same, you draw with a pen to get nice lines,
+        # so you prefer them smoothed rather than getting the ugly mouse artefacts, but you use erasers to get
+        # rid of what you're erasing, so you don't want to aim the eraser paintakingly at something and then
+        # suddenly have slightly different things erased because of smoothing as you move it.
+        self.smooth_incrementally = INCREMENTAL_SMOOTHING and not layout.subpixel and not self.eraser
+        if self.smooth_incrementally:
+            # the smoothed part of the stroke is painted onto a copy of the lines, which we also use to restore
+            # the lines under the unsmoothed part when we replace it
+            self.smoothed_lines = np.array(self.lines_array)
+            self.smooth_brush = None
+            self.smoothed_upto = 0 # the index of the last point the smoothed part reaches
+            self.smoothed_samples = 0
+            self.unsmoothed_bbox = (1000000, 1000000, -1, -1)
+
         cx, cy = layout.drawing_area().xy2frame(x, y)
-        self.init_brush(cx, cy, smoothDist=20)
+        self.init_brush(cx, cy, smoothDist=20, time=layout.event_time, pressure=layout.pressure)
         if self.eraser:
-            self.pen_mask = self.lines_array == 255
             self.brush_flood_fill_color_based_on_mask()
 
+        self.stroke_bbox = (1000000, 1000000, -1, -1)
         self.new_history_item()
 
         self.prev_drawn = (x,y) # Krita feeds the first x,y twice - in init-paint and in paint, here we do, too
         self.on_mouse_move(x,y)
+        self.paint_queued_points()
         if self.eraser: # we split eraser gestures into 1-second parts since sometimes you erase for a lot of time
             # without ever putting down the eraser and at some point erase too much and you don't want to undo all
             # that time spend erasing. with drawing it's less like it (undoing a part of the line seems less likely
@@ -1356,12 +2049,16 @@ class PenTool(Button):
         self.color_history_item = HistoryItem('color')
 
     def update_bbox(self):
-        xmin, ymin, xmax, ymax = self.bbox
-        rxmin, rymin, rxmax, rymax = self.rect
-        self.bbox = (min(xmin, rxmin), min(ymin, rymin), max(xmax, rxmax), max(ymax, rymax))
+        self.bbox = union_bbox(self.bbox, self.rect)
+        self.short_term_bbox = union_bbox(self.short_term_bbox, self.rect)
+        self.stroke_bbox = union_bbox(self.stroke_bbox, self.rect)
 
-        xmin, ymin, xmax, ymax = self.short_term_bbox
-        self.short_term_bbox = (min(xmin, rxmin), min(ymin, rymin), max(xmax, rxmax), max(ymax, rymax))
+    def update_pen_mask(self):
+        # erasing changes the lines, and the flood fill marks the pixels it fills in pen_mask, but only inside
+        # the stroke's bbox (which includes the flood-filled regions), so we don't need to recompute the mask elsewhere
+        xmin, ymin, xmax, ymax = self.stroke_bbox
+        if xmax >= 0:
+            self.pen_mask[xmin:xmax+1, ymin:ymax+1] = self.lines_array[xmin:xmax+1, ymin:ymax+1] == 255
 
     def smooth_line(self):
         try:
@@ -1375,21 +2072,82 @@ class PenTool(Button):
 
         self.init_brush(px[0], py[0])
         if self.eraser:
-            self.pen_mask = self.lines_array == 255
+            self.update_pen_mask() # the erasing was undone
             self.brush_flood_fill_color_based_on_mask()
 
-        xarr = np.zeros(1)
-        yarr = np.zeros(1)
-        t = 0
-        for x,y in zip(px,py):
-            t += 7
-            xarr[0] = x
-            yarr[0] = y
-            tinylib.brush_paint(self.brush, arr_base_ptr(xarr), arr_base_ptr(yarr), t, 1, self.region)
+        brush_paint_spline(self.brush, px, py, self.region)
+        self.update_bbox()
+
+        tinylib.brush_end_paint(self.brush, self.region)
+        self.update_bbox()
+
+    def smooth_stroke_part(self, final=False):
+        '''replaces the part of the stroke drawn since the last call, except for the last SMOOTHING_LAG points (or
+        including them if final), with a spline fitted to the points around it, and repaints the points after it as
+        they were drawn. this keeps the smoothing work per call bounded, rather than proportional to the stroke
+        length as in smooth_line()'''
+        pen_smooth_timer.start()
+        start = max(0, self.smoothed_upto - SMOOTHING_OVERLAP)
+        end = len(self.points) if final else len(self.points) - SMOOTHING_LAG
+        window = np.array(self.points[start:])
+        try:
+            px, py = bspline_interp(window, smoothing=len(window)/(layout.drawing_area().zoom*2))
+            # the spline's parameter is the distance along the points, and bspline_interp() evaluates it a pixel
+            # apart, so the i-th point is at about the distance from the first one along the points
+            dist = np.concatenate([[0], np.cumsum(np.hypot(*np.diff(window, axis=0).T))])
+            first, last = round(dist[self.smoothed_upto - start]), round(dist[end - 1 - start])
+        except:
+            # if we can't smooth the line (eg not enough points), NP - we wait for more points, or keep the raw input
+            # if there won't be any (unless we've already smoothed a part of it, in which case we continue it)
+            if not final or self.smooth_brush is None:
+                if final:
+                    tinylib.brush_end_paint(self.brush, self.region)
+                    self.update_bbox()
+                pen_smooth_timer.stop()
+                return
+            px, py = window[:,0], window[:,1]
+            first, last = self.smoothed_upto - start, len(window) - 1
+        if final:
+            last = len(px) - 1
+        elif last <= first:
+            pen_smooth_timer.stop()
+            return # the points since the last call are too close together to smooth
+
+        if self.smooth_brush is None:
+            self.smooth_brush = self.make_brush(px[0], py[0], lines=self.smoothed_lines)
+            xs, ys = px[:last+1], py[:last+1]
+        else:
+            xs, ys = px[first+1:last+1], py[first+1:last+1]
+        brush_paint_spline(self.smooth_brush, xs, ys, self.region, self.smoothed_samples)
+        self.smoothed_samples += len(xs)
+        self.update_bbox()
+        changed = union_bbox(self.unsmoothed_bbox, self.rect)
+        if final:
+            tinylib.brush_end_paint(self.smooth_brush, self.region)
+            self.smooth_brush = None
             self.update_bbox()
+            changed = union_bbox(changed, self.rect)
 
+        # the unsmoothed part is replaced by restoring the lines under everything the brush painted since the last
+        # call (including the end of the stroke it paints when ended) from the smoothed lines
         tinylib.brush_end_paint(self.brush, self.region)
+        self.brush = 0
         self.update_bbox()
+        xmin, ymin, xmax, ymax = union_bbox(changed, self.rect)
+        if xmax >= 0:
+            self.lines_array[xmin:xmax+1, ymin:ymax+1] = self.smoothed_lines[xmin:xmax+1, ymin:ymax+1]
+        self.short_term_bbox = union_bbox(self.short_term_bbox, (xmin, ymin, xmax, ymax))
+
+        if not final:
+            # the points after the smoothed part are repainted starting where it ends
+            _, _, time, pressure = self.samples[end-1]
+            self.init_brush(px[last], py[last], smoothDist=20, time=time, pressure=pressure)
+            samples = brush_samples(*zip(*([(px[last], py[last], time, pressure)] + self.samples[end:])))
+            tinylib.brush_paint_many(self.brush, arr_base_ptr(samples), len(samples), layout.drawing_area().xscale, self.region, None)
+            self.update_bbox()
+            self.unsmoothed_bbox = tuple(self.rect)
+            self.smoothed_upto = end - 1
+        pen_smooth_timer.stop()
 
     def on_mouse_up(self, x, y):
         if self.patching or curr_layer_locked():
@@ -1400,22 +2158,27 @@ class PenTool(Button):
             self.timer.stop()
 
         movie.edit_curr_frame()
-        tinylib.brush_end_paint(self.brush, self.region)
-        self.update_bbox()
+        self.paint_queued_points()
+        if self.smooth_incrementally:
+            self.smooth_stroke_part(final=True) # this ends the brush
+            self.smoothed_lines = None
+        else:
+            tinylib.brush_end_paint(self.brush, self.region)
+            self.update_bbox()
 
-        # the code in smooth_line() works for erasers ATM but it doesn't sound good to smooth "mice erasers"
-        # because while nominally pens and erasers are basically the same, you draw with a pen to get nice lines,
-        # so you prefer them smoothed rather than getting the ugly mouse artefacts, but you use erasers to get
-        # rid of what you're erasing, so you don't want to aim the eraser paintakingly at something and then
-        # suddenly have slightly different things erased because of smoothing when you lift the pen.
-        if not layout.subpixel and not self.eraser:
-            self.smooth_line()
+            # we don't smooth erasers for the reasons explained in on_mouse_down()
+            if not layout.subpixel and not self.eraser:
+                self.smooth_line()
 
         self.brush = 0
         self.prev_drawn = None
 
         self.save_history_item()
 
+        if self.eraser:
+            self.update_pen_mask()
+            movie.frame(movie.pos).store_solid_lines_mask(self.pen_mask)
+            self.pen_mask = None
         self.lines_array = None
 
         pen_up_timer.stop()
@@ -1427,6 +2190,7 @@ class PenTool(Button):
             history.append_item(history_item)
 
     def on_history_timer(self):
+        self.paint_queued_points()
         self.save_history_item()
         self.new_history_item()
         self.set_history_timer()
@@ -1449,24 +2213,45 @@ class PenTool(Button):
         if self.eraser and self.bucket_color is None:
             nx, ny = round(cx), round(cy)
             if nx>=0 and ny>=0 and nx<self.lines_array.shape[0] and ny<self.lines_array.shape[1] and self.lines_array[nx,ny] == 0:
+                self.paint_queued_points() # these are erased without the flood fill
                 self.bucket_color = movie.edit_curr_frame().surf_by_id('color').get_at((nx,ny))
                 self.brush_flood_fill_color_based_on_mask()
+        sample = (cx, cy, layout.event_time, layout.pressure)
         self.points.append((cx,cy))
+        self.samples.append(sample)
 
+        # we only queue the point here; the queued points are painted when the batch of mouse moves they came in
+        # is handled (see TinymationWidget.queueMotion), with one tinylib call and one drawing area update
         if self.prev_drawn:
-            self.short_term_bbox = (1000000, 1000000, -1, -1)
-            xarr = np.array([cx])
-            yarr = np.array([cy])
-            tinylib.brush_paint(self.brush, arr_base_ptr(xarr), arr_base_ptr(yarr), time.time_ns()*1000000, drawing_area.xscale, self.region)
-            self.update_bbox()
-
-            if self.short_term_bbox[-1] >= 0:
-                layout.drawing_area().draw_region(self.short_term_bbox)
-                widget.redrawScreen()
+            self.queued_points.append(sample)
             
         self.prev_drawn = (x,y) 
         pen_move_timer.stop()
 
+    def on_mouse_moves_done(self):
+        self.paint_queued_points()
+
+    def paint_queued_points(self):
+        if not self.queued_points:
+            return
+        pen_paint_timer.start()
+        samples = brush_samples(*zip(*self.queued_points))
+        self.queued_points = []
+
+        drawing_area = layout.drawing_area()
+        self.short_term_bbox = (1000000, 1000000, -1, -1)
+        tinylib.brush_paint_many(self.brush, arr_base_ptr(samples), len(samples), drawing_area.xscale, self.region, None)
+        self.update_bbox()
+        if self.smooth_incrementally:
+            self.unsmoothed_bbox = union_bbox(self.unsmoothed_bbox, self.rect)
+            if len(self.points) - self.smoothed_upto >= SMOOTHING_STEP + SMOOTHING_LAG:
+                self.smooth_stroke_part()
+
+        if self.short_term_bbox[-1] >= 0:
+            drawing_area.draw_region(self.short_term_bbox)
+            widget.redrawScreen()
+        pen_paint_timer.stop()
+
 MIN_ZOOM, MAX_ZOOM = 1, 5
 
 class ZoomTool(Button):
@@ -1480,8 +2265,11 @@ class ZoomTool(Button):
         self.frame_start = da.xy2frame(x,y)
         self.orig_zoom = da.zoom
         da.set_zoom_center(self.start)
+        da.start_zoom_pan_preview()
     def on_mouse_up(self, x, y):
-        layout.drawing_area().draw()
+        da = layout.drawing_area()
+        da.stop_zoom_pan_preview()
+        da.draw()
     def on_mouse_move(self, x, y):
         px, py = self.start
         up = y < py
@@ -1551,7 +2339,7 @@ def flood_fill_color_based_on_lines(color_rgba, lines, x, y, bucket_color, bbox_
 
     return bbox_retval
 
-def flood_fill_color_based_on_mask_many_seeds(color_rgba, pen_mask, xs, ys, bucket_color):
+def flood_fill_color_based_on_mask_near_segment(color_rgba, pen_mask, x1, y1, x2, y2, distance, bucket_color):
     mask_ptr, mask_stride, width, height = greyscale_c_params(pen_mask, is_alpha=False)
     flood_code = 2
 
@@ -1562,60 +2350,58 @@ def flood_fill_color_based_on_mask_many_seeds(color_rgba, pen_mask, xs, ys, buck
     rect = np.zeros(4, dtype=np.int32)
     region = arr_base_ptr(rect)
 
-    assert len(xs) == len(ys)
-    assert xs.strides == (4,)
-    assert ys.strides == (4,)
-    x_ptr = arr_base_ptr(xs)
-    y_ptr = arr_base_ptr(ys)
-
-    tinylib.flood_fill_color_based_on_mask_many_seeds(color_ptr, mask_ptr, color_stride, mask_stride,
-        width, height, region, 0, flood_code, new_color_value, x_ptr, y_ptr, len(xs))
+    tinylib.flood_fill_color_based_on_mask_near_segment(color_ptr, mask_ptr, color_stride, mask_stride,
+        width, height, region, 0, flood_code, new_color_value, x1, y1, x2, y2, distance)
     xmin, ymin, xmax, ymax = rect
     if xmax >= 0 and ymax >= 0:
         return xmin, ymin, xmax-1, ymax-1
 
-def point_line_distance_vectorized(px, py, x1, y1, x2, y2):
-    """ Vectorized calculation of distance from multiple points (px, py) to the line segment (x1, y1)-(x2, y2) """
-    line_mag = np.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
-    if line_mag < 1e-8:
-        # The line segment is a point
-        return np.sqrt((px - x1) ** 2 + (py - y1) ** 2)
-    
-    # Projection of points on the line segment
-    u = ((px - x1) * (x2 - x1) + (py - y1) * (y2 - y1)) / (line_mag ** 2)
-    u = np.clip(u, 0, 1)  # Clamping the projection
-    
-    # Coordinates of the projection points
-    ix = x1 + u * (x2 - x1)
-    iy = y1 + u * (y2 - y1)
-    
-    # Distance from points to the projection points
-    return np.sqrt((px - ix) ** 2 + (py - iy) ** 2)
-
-def integer_points_near_line_segment(x1, y1, x2, y2, distance):
-    """ Vectorized find all integer coordinates within a given distance from the line segment (x1, y1)-(x2, y2) """
-    # Determine the bounding box
-    xmin = np.floor(min(x1, x2) - distance)
-    xmax = np.ceil(max(x1, x2) + distance)
-    ymin = np.floor(min(y1, y2) - distance)
-    ymax = np.ceil(max(y1, y2) + distance)
-    
-    # Generate grid of integer points within the bounding box
-    x = np.arange(xmin, xmax + 1)
-    y = np.arange(ymin, ymax + 1)
-    xx, yy = np.meshgrid(x, y)
-    
-    # Flatten the grids to get coordinates
-    px, py = xx.ravel(), yy.ravel()
-    
-    # Compute distances using vectorized function
-    distances = point_line_distance_vectorized(px, py, x1, y1, x2, y2)
-    
-    # Filter points within the specified distance
-    mask = distances <= distance
-    result_points = np.vstack((px[mask], py[mask])).T
-    
-    return result_points.astype(np.int32)
+class FrameRegions:
+    '''the connected regions of the pixels not covered by solid lines (4-connected, like the regions flood-filled by
+    flood_fill_color_based_on_mask_near_segment()), and the horizontal spans making up each region. this lets
+    the paint bucket recolor the regions under the cursor without flood-filling them, and without looking at the lines'''
+    def __init__(self, lines):
+        # we index the pixels by y, x, as they're laid out in memory (unlike the surfarray arrays)
+        open_pixels = np.ascontiguousarray(lines.T != 255).view(np.uint8)
+        nregions, self.labels, stats, _ = cv2.connectedComponentsWithStats(open_pixels, connectivity=4, ltype=cv2.CV_32S)
+        # label 0 is the lines; the bounding boxes are xmin, ymin, xmax, ymax (inclusive)
+        self.bboxes = np.ascontiguousarray(np.column_stack([stats[:,0], stats[:,1], stats[:,0]+stats[:,2]-1, stats[:,1]+stats[:,3]-1]), dtype=np.int32)
+
+        # a span starts wherever the label changes along a row, and ends where the next one starts
+        height, width = self.labels.shape
+        starts = np.ones(self.labels.shape, bool)
+        starts[:,1:] = self.labels[:,1:] != self.labels[:,:-1]
+        ys, xs = np.nonzero(starts)
+        ends = np.empty_like(xs)
+        ends[:-1] = xs[1:] - 1
+        row_ends = np.append(ys[1:] != ys[:-1], True)
+        ends[row_ends] = width - 1
+
+        # the spans of region i are spans[first_span[i]:first_span[i+1]]
+        span_labels = self.labels[ys, xs]
+        order = np.argsort(span_labels, kind='stable')
+        self.spans = np.ascontiguousarray(np.column_stack([ys, xs, ends])[order], dtype=np.int32)
+        self.first_span = np.zeros(nregions+1, dtype=np.int32)
+        np.cumsum(np.bincount(span_labels, minlength=nregions), out=self.first_span[1:])
+
+    @property
+    def nbytes(self): return self.labels.nbytes + self.spans.nbytes
+
+    def fill(self, color_rgba, x1, y1, x2, y2, distance, bucket_color):
+        '''fills the regions containing the points within the distance from the line segment (x1, y1)-(x2, y2)
+        with bucket_color, except for the points on the lines or where the color is already bucket_color - like
+        flood_fill_color_based_on_mask_near_segment() does. returns the bounding box of the filled regions
+        (inclusive), or None if none were filled'''
+        color_ptr, color_stride, width, height, bgr = color_c_params(color_rgba)
+        new_color_value = make_color_int(bucket_color, bgr)
+
+        rect = np.zeros(4, dtype=np.int32)
+        tinylib.fill_color_regions_near_segment(color_ptr, color_stride, width, height,
+            arr_base_ptr(self.labels), self.labels.strides[0], arr_base_ptr(self.spans), arr_base_ptr(self.first_span),
+            arr_base_ptr(self.bboxes), arr_base_ptr(rect), new_color_value, x1, y1, x2, y2, distance)
+        xmin, ymin, xmax, ymax = rect
+        if xmax >= 0 and ymax >= 0:
+            return xmin, ymin, xmax-1, ymax-1
 
 class PaintBucketTool(Button):
     color2tool = {}
@@ -1631,8 +2417,20 @@ class PaintBucketTool(Button):
         self.px = None
         self.py = None
         self.bboxes = []
+        self.regions = None
+        self.regions_key = None
         self.pen_mask = None
         self.patching = False
+
+    @staticmethod
+    def prefetch_regions():
+        '''has BackgroundPool compute the regions of the current frame if the paint bucket is the current tool,
+        so that they're ready when it's used. (while the bucket is filling, every move changes the frame version,
+        and the regions it has are kept for the new version when it's done - see on_mouse_up())'''
+        tool = layout.tool
+        if isinstance(tool, PaintBucketTool) and tool.regions is None and not layout.is_pressed and not movie.curr_frame().empty():
+            movie.curr_frame().regions(background=True)
+
     def fill(self, x, y):
         paint_bucket_timer.start()
 
@@ -1643,17 +2441,19 @@ class PaintBucketTool(Button):
             self.px = x
             self.py = y
 
+        # we fill the regions under the bucket's path since the last point (tinylib finds the points
+        # near the path, so we don't compute them here)
         radius = (PAINT_BUCKET_WIDTH//2) * layout.drawing_area().xscale
-        with bucket_points_near_line_timer:
-            points = integer_points_near_line_segment(self.px, self.py, x, y, radius)
-            xs = points[:,0]
-            ys = points[:,1]
+        segment = (self.px, self.py, x, y, radius)
         self.px = x
         self.py = y
         
         with bucket_flood_fill_timer:
             color_rgba = pg.surfarray.pixels3d(movie.edit_curr_frame().surf_by_id('color'))
-            bbox = flood_fill_color_based_on_mask_many_seeds(color_rgba, self.pen_mask, xs, ys, self.color)
+            if self.regions is not None:
+                bbox = self.regions.fill(color_rgba, *segment, self.color)
+            else:
+                bbox = flood_fill_color_based_on_mask_near_segment(color_rgba, self.pen_mask, *segment, self.color)
         if bbox:
             self.bboxes.append(bbox)
 
@@ -1671,18 +2471,26 @@ class PaintBucketTool(Button):
         if self.patching:
             FlashlightTool().on_mouse_down(x,y)
             return
+        # the regions are usually computed in the background by now (see prefetch_regions()); if they aren't,
+        # we flood-fill based on the lines rather than wait for them, and take the regions from BackgroundPool
+        # when we're done if they're ready by then, for the next fill. (we look them up before HistoryItem() changes the frame version)
+        frame = movie.curr_frame()
+        self.regions = frame.regions(background=True)
+        self.regions_key = frame.regions(key=True)
+        if self.regions is None:
+            lines = pg.surfarray.pixels_alpha(frame.surf_by_id('lines'))
+            self.pen_mask = lines == 255
+
         self.history_item = HistoryItem('color')
         self.bboxes = []
         self.px = None
         self.py = None
-        lines = pg.surfarray.pixels_alpha(movie.curr_frame().surf_by_id('lines'))
-        self.pen_mask = lines == 255
 
         self.fill(x,y)
     def on_mouse_move(self, x, y):
         if self.patching or curr_layer_locked():
             return
-        if self.pen_mask is None: # pen_mask is None has been known to happen in flood_fill_color_based_on_mask_many_seeds...
+        if self.regions is None and self.pen_mask is None: # pen_mask is None has been known to happen in flood_fill_color_based_on_mask_near_segment...
             self.on_mouse_down(x,y)
         else:
             self.fill(x,y)
@@ -1700,7 +2508,13 @@ class PaintBucketTool(Button):
                 maxy = max(imaxy, maxy)
             self.history_item.optimize((minx, miny, maxx, maxy))
             history.append_item(self.history_item)
+        if self.regions is None:
+            self.regions = background_pool.take(self.regions_key)
+        if self.regions is not None:
+            movie.curr_frame().store_regions(self.regions) # we only changed the color
         self.history_item = None
+        self.regions = None
+        self.regions_key = None
         self.pen_mask = None
     def modify(self):
         if self.change_color is None:
@@ -2016,18 +2830,10 @@ def patch_hole(lines, x, y, skeleton, skx, sky):
     history_item = HistoryItem('lines', bbox=(minx, miny, maxx, maxy))
     history.append_item(history_item)
 
-    ptr, ystride, width, height = greyscale_c_params(lines)
-    brush = tinylib.brush_init_paint(px[0], py[0], 0, 2.5, 0, 0, ptr, width, height, 4, ystride)
-    xarr = np.zeros(1)
-    yarr = np.zeros(1)
-    t = 0
+    brush = brush_init_paint(px[0], py[0], 2.5, 0, False, lines)
     rect = np.zeros(4, dtype=np.int32)
     region = arr_base_ptr(rect)
-    for x,y in zip(px,py):
-        t += 7
-        xarr[0] = x
-        yarr[0] = y
-        tinylib.brush_paint(brush, arr_base_ptr(xarr), arr_base_ptr(yarr), t, 1, region)
+    brush_paint_spline(brush, px, py, region)
 
     tinylib.brush_end_paint(brush, region)
 
@@ -2134,6 +2940,9 @@ class Layout:
         self.focus_elem = None
         self.restore_tool_on_mouse_up = False
         self.mode = ANIMATION_LAYOUT
+        self.drawn_elems = None # the elements drawn by the last draw(), None if the screen was drawn over since
+        self.event_time = 0 # the timestamp (in ms) and the pressure of the mouse event being handled
+        self.pressure = 1
 
     def aspect_ratio(self): return self.width/self.height
 
@@ -2146,6 +2955,8 @@ class Layout:
         self.elems.append(elem)
 
     def draw_locked(self):
+        screen_damage.add()
+        self.drawn_elems = None
         screen.fill(PEN)
         screen.blit(locked_image, ((screen.get_width()-locked_image.get_width())//2, (screen.get_height()-locked_image.get_height())//2))
 
@@ -2161,23 +2972,37 @@ class Layout:
 
         layout_draw_timer.start()
 
+        # the pixels outside the elements only change when the set of elements we draw changes, so normally
+        # only the elements' rectangles are damaged
+        elems = [elem for elem in self.elems if (not self.is_playing or isinstance(elem, DrawingArea) or isinstance(elem, TogglePlaybackButton)) and not self.hidden(elem)]
+        if elems != self.drawn_elems:
+            screen_damage.add()
+        self.drawn_elems = elems
+
         screen.fill(UNDRAWABLE)
-        for elem in self.elems:
-            if not self.is_playing or isinstance(elem, DrawingArea) or isinstance(elem, TogglePlaybackButton):
-                if self.hidden(elem):
-                    continue
-                try:
-                    elem.draw()
-                except:
-                    import traceback
-                    traceback.print_exc()
-                    pygame.draw.rect(screen, (255,0,0), elem.rect, 3, 3)
-                    continue
-                if elem.draw_border:
-                    pygame.draw.rect(screen, PEN, elem.rect, 1, 1)
+        for elem in elems:
+            self._draw_elem(elem)
 
         layout_draw_timer.stop()
 
+    def _draw_elem(self, elem):
+        screen_damage.add(elem.rect)
+        try:
+            elem.draw()
+        except:
+            import traceback
+            traceback.print_exc()
+            pygame.draw.rect(screen, (255,0,0), elem.rect, 3, 3)
+            return
+        if elem.draw_border:
+            pygame.draw.rect(screen, PEN, elem.rect, 1, 1)
+
+    def redraw_timeline(self):
+        timeline = self.timeline_area()
+        if self.is_playing or self.hidden(timeline):
+            return
+        self._draw_elem(timeline)
+
     # note that pygame seems to miss mousemove events with a Wacom pen when it's not pressed.
     # (not sure if entirely consistently.) no such issue with a regular mouse
     def on_event(self,event):
@@ -2188,14 +3013,15 @@ class Layout:
             # which can create a "backlog" where we keep redrawing after the mouse stops moving because we
             # lag after mouse motion.] TODO: do we want to use a similar approach elsewhere?..
             elif self.is_pressed and self.zoom_pan_tool() and self.focus_elem is self.drawing_area():
-                cache.lock() # the chance to need to redraw with the same intermediate zoom/pan is low
-                self.drawing_area().draw()
-                cache.unlock()
+                self.drawing_area().draw_zoom_pan_preview()
                 #pg.display.flip()
 
         if event.type == FADING_TIMER_EVENT:
             self.drawing_area().update_fading_mask()
 
+        if event.type == BACKGROUND_POOL_EVENT and background_pool.collect():
+            self.redraw_timeline() # show the thumbnails computed in the background
+
         if event.type == SAVING_TIMER_EVENT:
             movie.frame(movie.pos).save()
 
@@ -2211,6 +3037,8 @@ class Layout:
             # we eg are drawing a line even though we aren't actually trying
 
         x, y = event.pos
+        self.event_time = event.time
+        self.pressure = event.pressure
 
         dispatched = False
         for elem in self.elems:
@@ -2229,6 +3057,14 @@ class Layout:
             self._dispatch_event(None, event, x, y)
             return
 
+    def on_mouse_moves(self, events):
+        # handles a batch of queued mouse moves; the focus element can defer the work it does per move
+        # to on_mouse_moves_done() and do it once for the whole batch
+        for event in events:
+            self.on_event(event)
+        if self.is_pressed and self.focus_elem:
+            self.focus_elem.on_mouse_moves_done()
+
     def _dispatch_event(self, elem, event, x, y):
         if event.type == pygame.MOUSEBUTTONDOWN:
             change = tool_change
@@ -2250,6 +3086,11 @@ class Layout:
             if self.focus_elem:
                 self.focus_elem.on_mouse_move(x,y)
 
+        # elements can redraw themselves when handling events (eg to show a scroll indicator); the drawing area
+        # reports the regions it redraws by itself since it's large and usually only a small part of it changes
+        if self.focus_elem is not None and not isinstance(self.focus_elem, DrawingArea):
+            screen_damage.add(self.focus_elem.rect)
+
     def drawing_area(self):
         assert isinstance(self.elems[0], DrawingArea)
         return self.elems[0]
@@ -2264,6 +3105,10 @@ class Layout:
     def toggle_playing(self):
         self.is_playing = not self.is_playing
         self.playing_index = 0
+        if self.is_playing:
+            self.drawing_area().prepare_playback()
+        else:
+            self.drawing_area().clear_playback_ring()
             
 # assumes either 16:9 or 9:16
 def scale_and_fully_preserve_aspect_ratio(w, h, width, height):
@@ -2292,6 +3137,10 @@ class DrawingArea(LayoutElemBase):
         self.xoffset = 0
         self.yoffset = 0
         self.fading_mask_version = 0
+        self.playback_ring = {} # see prepare_playback()
+        self.playback_view = None
+        self.playback_ring_rect = None
+        self.zoom_pan_sources = []
         self.restore_tool_on_mouse_up = False
 
         left, bottom, width, height = self.rect
@@ -2448,13 +3297,18 @@ class DrawingArea(LayoutElemBase):
                 id2version, comp = key
                 return id2version, ('scaled-to-drawing-area', comp, self.zoom, self.xoffset, self.yoffset)
             def compute_value(_):
-                step_aligned_frame_roi, scaled_roi_subset, _ = self.rois()
-                return scale_image(surface.subsurface(step_aligned_frame_roi), inv_scale=1/self.xscale).subsurface(scaled_roi_subset)
+                return self.scale_to_roi(surface)
         if get_key:
             return ScaledSurface().compute_key()
         if surface is None:
             return None
         return cache.fetch(ScaledSurface())
+    def scale_to_roi(self, surface):
+        step_aligned_frame_roi, scaled_roi_subset, _ = self.rois()
+        if isinstance(surface, np.ndarray): # an alpha array, see scale_alpha()
+            def sub(a, roi): return a[roi[0]:roi[0]+roi[2], roi[1]:roi[1]+roi[3]]
+            return sub(scale_alpha(sub(surface, step_aligned_frame_roi), inv_scale=1/self.xscale), scaled_roi_subset)
+        return scale_image(surface.subsurface(step_aligned_frame_roi), inv_scale=1/self.xscale).subsurface(scaled_roi_subset)
     def set_fading_mask(self, fading_mask, skeleton=None):
         self.fading_mask_version += 1
         cache.update_id('fading-mask', self.fading_mask_version)
@@ -2475,6 +3329,7 @@ class DrawingArea(LayoutElemBase):
         self.set_zoom(1)
     def draw(self):
         drawing_area_draw_timer.start()
+        screen_damage.add(self.rect)
 
         left, bottom, width, height = self.rect
 
@@ -2493,18 +3348,13 @@ class DrawingArea(LayoutElemBase):
 
         pos = layout.playing_index if layout.is_playing else movie.pos
         highlight = not layout.is_playing and not movie.curr_layer().locked
-        surfaces = []
+        _, _, starting_point = self.rois()
 
-        step_aligned_frame_roi, scaled_roi_subset, starting_point = self.rois()
-        iscale = 1/self.xscale
-
-        with draw_bottom_timer:
-            surfaces.append(movie.curr_bottom_layers_surface(pos, highlight=highlight, roi=step_aligned_frame_roi, inv_scale=iscale, subset=scaled_roi_subset))
-        if movie.layers[movie.layer_pos].visible:
-            with draw_curr_timer:
-                surfaces.append(movie.get_thumbnail(pos, transparent_single_layer=movie.layer_pos, roi=step_aligned_frame_roi, inv_scale=iscale).subsurface(scaled_roi_subset))
-        with draw_top_timer:
-            surfaces.append(movie.curr_top_layers_surface(pos, highlight=highlight, roi=step_aligned_frame_roi, inv_scale=iscale, subset=scaled_roi_subset))
+        playback_frame = self.playback_frame(pos) if layout.is_playing else None
+        if playback_frame is not None:
+            surfaces = [playback_frame]
+        else:
+            surfaces = self.layers_surfaces(pos, highlight)
 
         if not layout.is_playing:
             with draw_light_timer:
@@ -2528,9 +3378,162 @@ class DrawingArea(LayoutElemBase):
 
         if layout.is_playing:
             self.restore_zoom_pan_params(zoom_params)
+        else:
+            PaintBucketTool.prefetch_regions()
 
         drawing_area_draw_timer.stop()
 
+    def layers_view(self):
+        '''the part of the frames layers_surfaces() shows, and their scale - for calling it in a worker thread, where
+        the zoom & pan parameters might be different by the time it runs'''
+        step_aligned_frame_roi, scaled_roi_subset, _ = self.rois()
+        return step_aligned_frame_roi, scaled_roi_subset, 1/self.xscale
+
+    def layers_surfaces(self, pos, highlight, view=None):
+        '''returns the surfaces to blit, in order, at the drawing area starting point to show the layers at pos'''
+        surfaces = []
+
+        step_aligned_frame_roi, scaled_roi_subset, iscale = self.layers_view() if view is None else view
+
+        with draw_bottom_timer:
+            surfaces.append(movie.curr_bottom_layers_surface(pos, highlight=highlight, roi=step_aligned_frame_roi, inv_scale=iscale, subset=scaled_roi_subset))
+        if movie.layers[movie.layer_pos].visible:
+            with draw_curr_timer:
+                surfaces.append(movie.get_thumbnail(pos, transparent_single_layer=movie.layer_pos, roi=step_aligned_frame_roi, inv_scale=iscale).subsurface(scaled_roi_subset))
+        with draw_top_timer:
+            surfaces.append(movie.curr_top_layers_surface(pos, highlight=highlight, roi=step_aligned_frame_roi, inv_scale=iscale, subset=scaled_roi_subset))
+
+        return surfaces
+
+    def prefetch_layers(self, pos, highlight):
+        '''has BackgroundPool compute the surfaces layers_surfaces() would return for pos, unless they're cached'''
+        step_aligned_frame_roi, scaled_roi_subset, _ = self.rois()
+        iscale = 1/self.xscale
+
+        movie.curr_bottom_layers_surface(pos, highlight=highlight, roi=step_aligned_frame_roi, inv_scale=iscale, subset=scaled_roi_subset, background=True)
+        if movie.layers[movie.layer_pos].visible:
+            movie.get_thumbnail(pos, transparent_single_layer=movie.layer_pos, roi=step_aligned_frame_roi, inv_scale=iscale, background=True, prefetch=True)
+        movie.curr_top_layers_surface(pos, highlight=highlight, roi=step_aligned_frame_roi, inv_scale=iscale, subset=scaled_roi_subset, background=True)
+
+    def prepare_playback(self):
+        '''has BackgroundPool render the frames of the playback loop, so that playback only needs to blit them
+        [draw() composes the frames which aren't ready yet itself.] this keeps us from missing the deadline of the playback
+        timer in the first loop, or whenever cache eviction hits. the frames are kept outside the cache so they can't
+        be evicted during playback (it's fine to keep them out of the byte size accounting of the cache since they're
+        only kept until the playback stops.) positions showing the same frames in every layer share a rendered frame'''
+        zoom_params = self.get_zoom_pan_params()
+        self.reset_zoom_pan_params()
+        view = self.layers_view()
+        self.restore_zoom_pan_params(zoom_params)
+
+        background_pool.cancel_prefetches() # including the frames of the previous ring which didn't start rendering
+        self.playback_ring = {}
+        self.playback_view = view
+        self.playback_ring_rect = self.rect
+        _, (_, _, width, height), _ = view
+        positions = min(len(movie.frames), MAX_PLAYBACK_RING_BYTE_SIZE // max(1, width*height*4))
+        for pos in range(positions):
+            frame = self.CachedPlaybackFrame(self, pos, view)
+            # a ring replaced while the frame is computed is no longer shown, so we store the frame in the one we have now
+            background_pool.fetch(frame, frame.compute_key, prefetch=True, store=self.playback_ring.__setitem__)
+
+    class CachedPlaybackFrame(CachedItem):
+        def __init__(self, drawing_area, pos, view):
+            self.drawing_area = drawing_area
+            self.pos = pos
+            self.view = view
+        def compute_key(self):
+            return movie.signature(self.pos).id2version(), ('playback-frame', self.view)
+        def compute_value(self):
+            return compose_surfaces(self.drawing_area.layers_surfaces(self.pos, highlight=False, view=self.view))
+
+    def playback_frame(self, pos):
+        '''returns the frame prepare_playback() rendered for pos, or None if it's not ready (or was rendered
+        from a movie which was changed since)'''
+        if not self.playback_ring or self.playback_ring_rect != self.rect:
+            return None
+        return self.playback_ring.get(self.CachedPlaybackFrame(self, pos, self.playback_view).compute_key())
+
+    def clear_playback_ring(self):
+        '''forgets the frames prepare_playback() rendered; while playing, they're rendered again'''
+        if layout.is_playing:
+            self.prepare_playback()
+        elif self.playback_view is not None:
+            background_pool.cancel_prefetches()
+            self.playback_ring = {}
+            self.playback_view = None
+
+    def zoom_pan_source(self, surfaces):
+        '''returns the surfaces blitted at the starting point composed into one, together with the frame region it shows'''
+        _, _, (sx, sy) = self.rois()
+        surface = compose_surfaces(surfaces)
+        fx, fy = self.xy2frame(sx, sy)
+        return surface, (fx, fy, surface.get_width()*self.xscale, surface.get_height()*self.yscale)
+
+    def start_zoom_pan_preview(self):
+        '''while zooming/panning interactively, we don't rescale the frame from the full resolution at every step;
+        instead we take a region of an already scaled composite and stretch it with a cheap nearest-neighbor scaling.
+        the exact pixels are only rendered once the zooming/panning is done. we keep 2 such composites: the one shown
+        when the zooming/panning started (it has the most detail if we zoom in) and the one with the entire frame at zoom=1
+        (which we need when we zoom out or pan to the regions outside the first one.)'''
+        highlight = not movie.curr_layer().locked
+        def surfaces():
+            surfaces = self.layers_surfaces(movie.pos, highlight)
+            mask = layout.timeline_area().combined_light_table_mask()
+            if mask:
+                surfaces.append(mask)
+            return surfaces
+
+        self.zoom_pan_sources = [self.zoom_pan_source(surfaces())]
+        if self.zoom == 1:
+            return
+
+        zoom_params = self.get_zoom_pan_params()
+        self.reset_zoom_pan_params()
+        self.zoom_pan_sources.append(self.zoom_pan_source(surfaces()))
+        self.restore_zoom_pan_params(zoom_params)
+
+    def stop_zoom_pan_preview(self):
+        self.zoom_pan_sources = []
+
+    def draw_zoom_pan_preview(self):
+        if not self.zoom_pan_sources:
+            self.draw()
+            return
+
+        _, _, width, height = self.rect
+        sx, sy = max(0, self.xmargin - self.xoffset), max(0, self.ymargin - self.yoffset)
+        ex, ey = self.frame2xy(IWIDTH, IHEIGHT)
+        ex, ey = min(width, int(ex)), min(height, int(ey))
+        fx, fy = self.xy2frame(sx, sy)
+        fw, fh = (ex-sx)*self.xscale, (ey-sy)*self.yscale
+
+        def contains(region):
+            rx, ry, rw, rh = region
+            return fx >= rx and fy >= ry and fx+fw <= rx+rw+1 and fy+fh <= ry+rh+1
+        surface, (rx, ry, rw, rh) = next((s for s in self.zoom_pan_sources if contains(s[1])), self.zoom_pan_sources[-1])
+
+        # the region of the source surface showing the frame region we want to display
+        xscale = surface.get_width()/rw
+        yscale = surface.get_height()/rh
+        left = min(max(0, int((fx-rx)*xscale)), surface.get_width()-1)
+        bottom = min(max(0, int((fy-ry)*yscale)), surface.get_height()-1)
+        right = min(surface.get_width(), max(left+1, round((fx+fw-rx)*xscale)))
+        top = min(surface.get_height(), max(bottom+1, round((fy+fh-ry)*yscale)))
+
+        screen_damage.add(self.rect)
+        pygame.gfxdraw.box(self.subsurface, (0, 0, width, height), BACKGROUND)
+        self.subsurface.blit(pg.transform.scale(surface.subsurface((left, bottom, right-left, top-bottom)), (ex-sx, ey-sy)), (sx, sy))
+
+        eps = 0.019
+        if self.zoom > 1 + eps:
+            self.draw_zoom_surface()
+        else:
+            pygame.gfxdraw.box(self.subsurface, (0, 0, width, self.ymargin), MARGIN)
+            pygame.gfxdraw.box(self.subsurface, (0, self.ymargin, self.xmargin, height-self.ymargin), MARGIN)
+            pygame.gfxdraw.box(self.subsurface, (width-self.xmargin, self.ymargin, self.xmargin, height-self.ymargin), MARGIN)
+            pygame.gfxdraw.box(self.subsurface, (self.xmargin, height-self.ymargin, width-self.xmargin*2, self.ymargin), MARGIN)
+
     def draw_region(self, frame_region):
         xmin, ymin, xmax, ymax = frame_region
         xmax += 1
@@ -2601,6 +3604,7 @@ class DrawingArea(LayoutElemBase):
             return # drawing outside the visible area - nothing to repaint
 
         sub = self.subsurface.subsurface(trimmed_roi)
+        screen_damage.add((sub.get_abs_offset(), sub.get_size()))
 
         other_layers_roi = trim(trimmed_roi[0] - full_starting_point[0], trimmed_roi[1] - full_starting_point[1], trimmed_roi[2], trimmed_roi[3], bottom)
         sub.blit(bottom.subsurface(other_layers_roi), (0,0)) 
@@ -2666,6 +3670,8 @@ class DrawingArea(LayoutElemBase):
         layout.tool.on_mouse_up(*self.fix_xy(x,y))
     def on_mouse_move(self,x,y):
         layout.tool.on_mouse_move(*self.fix_xy(x,y))
+    def on_mouse_moves_done(self):
+        layout.tool.on_mouse_moves_done()
 
 class ScrollIndicator:
     def __init__(self, w, h, vertical=False):
@@ -2784,6 +3790,7 @@ class TimelineArea(LayoutElemBase):
         self.frame_boundaries = []
         self.eye_boundaries = []
         self.prevx = None
+        self.last_thumbnails = {} # frame ID -> the thumbnail shown the last time the timeline was drawn
 
         self._calc_factors()
 
@@ -2820,9 +3827,11 @@ class TimelineArea(LayoutElemBase):
         
         self.scroll_indicator = ScrollIndicator(self.subsurface.get_width(), self.subsurface.get_height())
 
-    def light_table_positions(self):
+    def light_table_positions(self, around_pos=None):
         # TODO: order 
-        covered_positions = {movie.pos} # the current position is definitely covered,
+        if around_pos is None:
+            around_pos = movie.pos
+        covered_positions = {around_pos} # the current position is definitely covered,
         # don't paint over it...
 
         num_enabled_pos = sum([enabled for pos_dist, enabled in self.on_light_table.items() if pos_dist>0])
@@ -2832,7 +3841,7 @@ class TimelineArea(LayoutElemBase):
         for pos_dist in self.traversal_order:
             if not self.on_light_table[pos_dist]:
                 continue
-            abs_pos = movie.pos + pos_dist
+            abs_pos = around_pos + pos_dist
             if not self.loop_mode and (abs_pos < 0 or abs_pos >= len(movie.frames)):
                 continue
             pos = abs_pos % len(movie.frames)
@@ -2856,8 +3865,8 @@ class TimelineArea(LayoutElemBase):
     def combined_light_table_mask(self):
         # there are 2 kinds of frame positions: those where the frame of the current layer (at movie.layer_pos) is the same
         # as the frame in the current position (at movie.pos) in that layer due to holds, and those where it's not.
-        # for the latter kind, we can combine all their masks produced by movie.get_mask together.
-        # for the former kind, we don't get_mask to recompute each position's mask when the current layer changes.
+        # for the latter kind, we can combine all their masks produced by movie.get_mask_alpha together.
+        # for the former kind, we don't get_mask_alpha to recompute each position's mask when the current layer changes.
         # so instead we do this:
         #   - we combine all the masks containing all the layers *except* the current one
         #   - we additionally combine all the masks containing all the layers *above* the current one
@@ -2867,8 +3876,9 @@ class TimelineArea(LayoutElemBase):
         curr_frame = movie.curr_frame()
         curr_layer = movie.layers[movie.layer_pos]
         curr_lit = curr_layer.lit and curr_layer.visible
-        held_positions = [(pos,c,t) for pos,c,t in light_table_positions if curr_lit and movie.frame(pos) is curr_frame]
-        rest_positions = [(pos,c,t) for pos,c,t in light_table_positions if not (curr_lit and movie.frame(pos) is curr_frame)]
+        def held(pos): return curr_lit and movie.signature(pos).frames[movie.layer_pos] is curr_frame
+        held_positions = [(pos,c,t) for pos,c,t in light_table_positions if held(pos)]
+        rest_positions = [(pos,c,t) for pos,c,t in light_table_positions if not held(pos)]
 
         def combine_masks(masks):
                 if len(masks) == 0:
@@ -2896,30 +3906,32 @@ class TimelineArea(LayoutElemBase):
                 id2version = []
                 computation = []
                 for pos, color, transparency in s.light_table_positions:
-                    i2v, c = movie.get_mask(pos, color, transparency, key=True, lowest_layer_pos=s.lowest_layer_pos, skip_layer=s.skip_layer)
+                    i2v, c = movie.get_mask_alpha(pos, key=True, lowest_layer_pos=s.lowest_layer_pos, skip_layer=s.skip_layer)
                     id2version += i2v
-                    computation.append(c)
+                    computation.append((color, transparency, c))
                 return tuple(id2version), ('combined-mask', tuple(computation))
                 
             def compute_value(s):
-                masks = []
-                for pos, color, transparency in s.light_table_positions:
-                    masks.append(movie.get_mask(pos, color, transparency, lowest_layer_pos=s.lowest_layer_pos, skip_layer=s.skip_layer))
-                return combine_masks(masks)
+                # the per-position mask alphas are cached separately from their colors, so when the light table changes,
+                # only the positions not shown before are recomputed, and coloring & combining is a single pass over them
+                if not s.light_table_positions:
+                    return None
+                alphas = [movie.get_mask_alpha(pos, lowest_layer_pos=s.lowest_layer_pos, skip_layer=s.skip_layer) for pos, _, _ in s.light_table_positions]
+                mask = blend_alpha_masks(alphas, [color for _, color, _ in s.light_table_positions])
+                mask.set_alpha(int(s.light_table_positions[0][2]*255)) # TODO: this assumes the same transparency in all masks - might want to change
+                return mask
 
         rest_mask = CachedCombinedMask(rest_positions)
         held_mask_outside = CachedCombinedMask(held_positions, skip_layer=movie.layer_pos)
         held_mask_inside = CachedCombinedMask(held_positions, lowest_layer_pos=movie.layer_pos+1)
         da = layout.drawing_area()
 
-        def scaled_key(cached_mask): return da.scale_and_cache(None, cached_mask.compute_key(), get_key=True)
-        def scaled(cached_mask):
-            k, v = cache.fetch_kv(cached_mask)
-            return da.scale_and_cache(v, k)
+        # (the masks combined from get_mask_alpha are already scaled to the drawing area)
+        def scaled(cached_mask): return cache.fetch(cached_mask)
 
         class AllPosMask:
             def compute_key(_):
-                keys = [scaled_key(m) for m in (rest_mask, held_mask_outside, held_mask_inside)]
+                keys = [m.compute_key() for m in (rest_mask, held_mask_outside, held_mask_inside)]
                 id2vs, comps = zip(*keys)
                 id2vs = sum(id2vs,(curr_frame.cache_id_version(),) if held_positions else tuple())
                 return id2vs, ('all-pos-mask', tuple(comps))
@@ -2983,8 +3995,22 @@ class TimelineArea(LayoutElemBase):
         self.frame_boundaries = []
         self.eye_boundaries = []
 
+        last_thumbnails = self.last_thumbnails
+        self.last_thumbnails = {}
+
         def draw_frame(pos, pos_dist, x, thumb_width):
-            scaled = movie.get_thumbnail(pos, thumb_width, height)
+            # thumbnails missing from the cache are computed in the background (see BackgroundPool); meanwhile,
+            # we show the last thumbnail we had for the frame stretched to the new size, or a blank one
+            frame_id = movie.frames[pos].id
+            scaled = movie.get_thumbnail(pos, thumb_width, height, background=True)
+            if scaled is not None:
+                self.last_thumbnails[frame_id] = scaled
+            elif frame_id in last_thumbnails:
+                scaled = pg.transform.scale(last_thumbnails[frame_id], (thumb_width, height))
+                self.last_thumbnails[frame_id] = last_thumbnails[frame_id]
+            else:
+                scaled = pg.Surface((thumb_width, height))
+                scaled.fill(BACKGROUND)
             surface.blit(scaled, (x, bottom), (0, 0, thumb_width, height))
             border = 1 + 2*(pos==movie.pos)
             pygame.draw.rect(surface, PEN, (x, bottom, thumb_width, height), border)
@@ -3074,6 +4100,7 @@ class TimelineArea(LayoutElemBase):
         for left, bottom, right, top, pos_dist in self.eye_boundaries:
             if y >= bottom and y <= top and x >= left and x <= right:
                 self.on_light_table[pos_dist] = not self.on_light_table[pos_dist]
+                layout.drawing_area().clear_playback_ring()
                 return True
 
     def update_loop_mode(self,x,y):
@@ -3145,6 +4172,29 @@ class TimelineArea(LayoutElemBase):
             else:
                 new_pos = min(max(0, movie.pos + pos_dist), len(movie.frames)-1)
             movie.seek_frame(new_pos)
+            self.prefetch(pos_dist)
+
+    def prefetch(self, step):
+        # when scrubbing, warm the cache for the positions we'll land on if the user keeps scrubbing in the same direction
+        # at the same speed, and for the light table around the next one, so that they're cache hits when we get there
+        background_pool.cancel_prefetches()
+        if step == 0 or layout.is_playing:
+            return
+        da = layout.drawing_area()
+        highlight = not movie.curr_layer().locked
+        curr_layer = movie.layers[movie.layer_pos]
+        def held(pos, at_pos): return curr_layer.lit and curr_layer.visible and movie.signature(pos).frames[movie.layer_pos] is movie.signature(at_pos).frames[movie.layer_pos]
+        for i in range(1, MAX_PREFETCHED_POSITIONS+1):
+            pos = movie.pos + step*i
+            if self.loop_mode:
+                pos %= len(movie.frames)
+            elif pos < 0 or pos >= len(movie.frames):
+                break
+            da.prefetch_layers(pos, highlight)
+            if i == 1:
+                for lt_pos, _, _ in self.light_table_positions(around_pos=pos):
+                    if not held(lt_pos, pos): # see combined_light_table_mask() for how the masks of held positions are computed
+                        movie.get_mask_alpha(lt_pos, curr_pos=pos, background=True)
 
 class LayersArea(LayoutElemBase):
     def init(self):
@@ -3174,7 +4224,7 @@ class LayersArea(LayoutElemBase):
             def __init__(s, color=None):
                 s.color = color
             def compute_key(s):
-                frame = layer.frame(movie.pos) # note that we compute the thumbnail even if the layer is invisible
+                frame = movie.signature(movie.pos).frames[layer_pos] # note that we compute the thumbnail even if the layer is invisible
                 return (frame.cache_id_version(),), ('colored-layer-thumbnail', self.width, s.color)
             def compute_value(se):
                 if se.color is None:
@@ -3267,6 +4317,7 @@ class LayersArea(LayoutElemBase):
                 layer = movie.layers[layer_pos]
                 layer.toggle_visible()
                 history.append_item(ToggleHistoryItem(layer.toggle_visible))
+                movie.composition_changed()
                 movie.clear_cache()
                 return True
 
@@ -3338,6 +4389,9 @@ class ProgressBar:
         self.total = total
         self.draw()
     def draw(self):
+        screen_damage.add(self.outer_rect)
+        if layout:
+            layout.drawn_elems = None
         pg.draw.rect(screen, UNUSED, self.outer_rect)
         pg.draw.rect(screen, BACKGROUND, self.inner_rect)
         left, bottom, full_width, height = self.inner_rect
@@ -3564,9 +4618,45 @@ class Tool:
         self.cursor = cursor
         self.chars = chars
 
+class CompositionSignature:
+    '''what a movie position is made of - the frame shown at this position in every layer [after following
+    the holds] - together with the cache key parts computed from these frames. Movie.signature() keeps one
+    of these per position and drops it when one of its frames is edited, or when the holds, the layers or their
+    visibility change, so that compute_key() doesn't walk the layers and the holds upon every cache fetch'''
+    def __init__(self, layers, pos):
+        self.frames = [layer.frame(pos) for layer in layers]
+        self.visible = [layer.visible for layer in layers]
+        self.layer_ids = [layer.id for layer in layers]
+        self.memo = {}
+
+    def _memoized(self, key, compute):
+        value = self.memo.get(key)
+        if value is None:
+            value = compute()
+            self.memo[key] = value
+        return value
+
+    def layer_indexes(self, start=0, end=None, include_invisible=False, skip=None):
+        if end is None:
+            end = len(self.frames)
+        return self._memoized(('indexes', start, end, include_invisible, skip),
+            lambda: [i for i in range(start, end) if i != skip and (include_invisible or self.visible[i])])
+
+    def id2version(self, start=0, end=None, include_invisible=False, skip=None):
+        def compute():
+            frames = [self.frames[i] for i in self.layer_indexes(start, end, include_invisible, skip)]
+            return tuple([frame.cache_id_version() for frame in frames if not frame.empty()])
+        return self._memoized(('id2version', start, end, include_invisible, skip), compute)
+
+    def nonempty_layer_ids(self, start=0, end=None):
+        def compute():
+            return tuple([self.layer_ids[i] for i in self.layer_indexes(start, end, include_invisible=True) if not self.frames[i].empty()])
+        return self._memoized(('layer-ids', start, end), compute)
+
 class Movie(MovieData):
     def __init__(self, dir, progress=default_progress_callback):
         iwidth, iheight = (IWIDTH, IHEIGHT)
+        self.pos2signature = {}
         MovieData.__init__(self, dir, progress=progress)
         if (iwidth, iheight) != (IWIDTH, IHEIGHT):
             init_layout()
@@ -3583,78 +4673,100 @@ class Movie(MovieData):
         else: # this frame was displayed and now won't be - save it before displaying the held one
             self.frames[pos].save()
         self.frames[pos].hold = not self.frames[pos].hold
+        self.composition_changed()
         self.clear_cache()
         self.save_meta()
 
     def frame(self, pos):
         return self.layers[self.layer_pos].frame(pos)
 
-    def get_mask(self, pos, rgb, transparency, key=False, lowest_layer_pos=None, skip_layer=None):
+    def signature(self, pos):
+        sig = self.pos2signature.get(pos)
+        if sig is None:
+            sig = CompositionSignature(self.layers, pos)
+            if not cache.worker_thread(): # a worker might be looking at the movie in the middle of a change
+                self.pos2signature[pos] = sig
+        return sig
+
+    def composition_changed(self):
+        # called when positions might be made of different frames than before (holds, inserted/removed
+        # frames or layers, layer visibility) - editing a frame's pixels is handled by edit_curr_frame()
+        self.pos2signature = {}
+
+    def get_mask_alpha(self, pos, key=False, lowest_layer_pos=None, skip_layer=None, curr_pos=None, background=False):
+        '''returns the light table mask alpha of pos, scaled to the drawing area (TimelineArea.combined_light_table_mask()
+        colors it and combines it with the other positions' masks)'''
         # ignore invisible layers
         if lowest_layer_pos is None:
             lowest_layer_pos = 0
-        layers = [layer for i,layer in enumerate(self.layers) if layer.visible and i>=lowest_layer_pos and i!=skip_layer]
+        if curr_pos is None:
+            curr_pos = self.pos
+        sig = self.signature(pos)
+        curr_sig = self.signature(curr_pos)
+        indexes = sig.layer_indexes(lowest_layer_pos, skip=skip_layer)
         # ignore the layers where the frame at the current position is an alias for the frame at the requested position
         # (it's visually noisy to see the same lines colored in different colors all over)
-        def lines_lit(layer): return layer.lit and layer.surface_pos(self.pos) != layer.surface_pos(pos)
+        def lines_lit(i): return self.layers[i].lit and sig.frames[i] is not curr_sig.frames[i]
+
+        # the mask is computed at full resolution, in 8 bits, then scaled to the drawing area (so the masks of all
+        # the light table positions are combined at the resolution they're shown at.) it doesn't depend on the color
+        # of the position in the light table, so it survives changes to the light table and movie.pos
+        da = layout.drawing_area()
 
         class CachedMaskAlpha:
             def compute_key(_):
-                frames = [layer.frame(pos) for layer in layers]
-                lines = tuple([lines_lit(layer) for layer in layers])
-                return tuple([frame.cache_id_version() for frame in frames if not frame.empty()]), ('mask-alpha', lines)
+                lines = tuple([lines_lit(i) for i in indexes])
+                return sig.id2version(lowest_layer_pos, skip=skip_layer), ('mask-alpha', lines)
             def compute_value(_):
-                alpha = np.zeros((empty_frame().get_width(), empty_frame().get_height()))
-                for layer in layers:
-                    frame = layer.frame(pos)
-                    pen = pygame.surfarray.pixels_alpha(frame.surf_by_id('lines'))
-                    color = pygame.surfarray.pixels_alpha(frame.surf_by_id('color'))
+                alpha = np.zeros((empty_frame().get_height(), empty_frame().get_width()), dtype=np.uint8).T
+                for i in indexes:
+                    frame = sig.frames[i]
                     # hide the areas colored by this layer, and expose the lines of these layer (the latter, only if it's lit and not held)
-                    alpha[:] = np.minimum(255-color, alpha)
-                    if lines_lit(layer):
-                        alpha[:] = np.maximum(pen, alpha)
+                    update_mask_alpha(alpha, frame.surf_by_id('lines'), frame.surf_by_id('color'), lines_lit(i))
                 return alpha
 
-        class CachedMask:
+        class CachedScaledMaskAlpha:
             def compute_key(_):
-                id2version, computation = CachedMaskAlpha().compute_key()
-                return id2version, ('mask', rgb, transparency, computation)
+                return da.scale_and_cache(None, CachedMaskAlpha().compute_key(), get_key=True)
             def compute_value(_):
-                mask_surface = pygame.Surface((empty_frame().get_width(), empty_frame().get_height()), pygame.SRCALPHA)
-                mask_surface.fill(rgb)
-                pg.surfarray.pixels_alpha(mask_surface)[:] = cache.fetch(CachedMaskAlpha())
-                mask_surface.set_alpha(int(transparency*255))
-                return mask_surface
+                return da.scale_to_roi(cache.fetch(CachedMaskAlpha()))
 
         if key:
-            return CachedMask().compute_key()
-        return cache.fetch(CachedMask())
+            return CachedScaledMaskAlpha().compute_key()
+        if background:
+            return background_pool.fetch(CachedScaledMaskAlpha(), lambda: self.get_mask_alpha(pos, True, lowest_layer_pos, skip_layer, curr_pos), prefetch=True)
+        return cache.fetch(CachedScaledMaskAlpha())
 
-    def _visible_layers_id2version(self, layers, pos, include_invisible=False):
-        frames = [layer.frame(pos) for layer in layers if layer.visible or include_invisible]
-        return tuple([frame.cache_id_version() for frame in frames if not frame.empty()])
+    def _visible_layers_id2version(self, pos, start=0, end=None, include_invisible=False):
+        return self.signature(pos).id2version(start, end, include_invisible=include_invisible)
 
-    def get_thumbnail(self, pos, width=None, height=None, highlight=True, transparent_single_layer=-1, roi=None, inv_scale=None):
+    def get_thumbnail(self, pos, width=None, height=None, highlight=True, transparent_single_layer=-1, roi=None, inv_scale=None, key=False, background=False, prefetch=False):
+        '''with background=True, returns None instead of computing a thumbnail which isn't cached, and has BackgroundPool compute it'''
         if roi is None:
             roi = (0, 0, IWIDTH, IHEIGHT) # the roi is in the original image coordinates, not the thumbnail coordinates
         trans_single = transparent_single_layer >= 0
         layer_pos = self.layer_pos if not trans_single else transparent_single_layer
-        def id2version(layers): return self._visible_layers_id2version(layers, pos, include_invisible=trans_single)
+        sig = self.signature(pos)
 
         class CachedThumbnail(CachedItem):
             def compute_key(_):
                 if trans_single:
-                    return id2version([self.layers[layer_pos]]), ('transparent-layer-thumbnail', width, height, roi, inv_scale)
+                    return sig.id2version(layer_pos, layer_pos+1, include_invisible=True), ('transparent-layer-thumbnail', width, height, roi, inv_scale)
                 else:
-                    def layer_ids(layers): return tuple([layer.id for layer in layers if not layer.frame(pos).empty()])
-                    hl = ('highlight', layer_ids(self.layers[:layer_pos]), layer_ids([self.layers[layer_pos]]), layer_ids(self.layers[layer_pos+1:])) if highlight else 'no-highlight'
-                    return id2version(self.layers), ('thumbnail', width, height, roi, hl, inv_scale)
+                    layer_ids = sig.nonempty_layer_ids
+                    hl = ('highlight', layer_ids(0, layer_pos), layer_ids(layer_pos, layer_pos+1), layer_ids(layer_pos+1)) if highlight else 'no-highlight'
+                    return sig.id2version(), ('thumbnail', width, height, roi, hl, inv_scale)
             def compute_value(_):
                 h = int(screen.get_height() * 0.15)
                 w = int(h * IWIDTH / IHEIGHT)
                 if inv_scale is not None or (w <= width and h <= height):
                     if trans_single:
-                        return self.layers[layer_pos].frame(pos).thumbnail(width, height, roi, inv_scale)
+                        frame = sig.frames[layer_pos]
+                        if inv_scale is not None:
+                            patched = self._patched_layer_thumbnail(frame, _.compute_key(), roi, inv_scale)
+                            if patched is not None:
+                                return patched
+                        return frame.thumbnail(width, height, roi, inv_scale)
 
                     s = self.curr_bottom_layers_surface(pos, highlight=highlight, width=width, height=height, roi=roi, inv_scale=inv_scale).copy()
                     if self.layers[self.layer_pos].visible:
@@ -3664,10 +4776,38 @@ class Movie(MovieData):
                 else:
                     return scale_image(self.get_thumbnail(pos, w, h, highlight=highlight, transparent_single_layer=transparent_single_layer, roi=roi), width, height)
 
+        if key:
+            return CachedThumbnail().compute_key()
+        if background:
+            return background_pool.fetch(CachedThumbnail(), lambda: self.get_thumbnail(pos, width, height, highlight, transparent_single_layer, roi, inv_scale, key=True), prefetch)
         return cache.fetch(CachedThumbnail())
 
+    def _patched_layer_thumbnail(self, frame, key, roi, inv_scale):
+        # when a frame is edited, rather than rescaling all of it, we take its thumbnail computed from the version
+        # before the edit and rescale the tiles covering the changed region. this works for the thumbnails shown in
+        # the drawing area, where the ROI and the scale are aligned to zoom_int_step_orig
+        da = layout.drawing_area()
+        if frame.empty() or inv_scale < 0.5 or abs(inv_scale*da.xscale - 1) > 1e-9: # below 0.5, scale_image() halves the image first
+            return None
+        step = da.zoom_int_step_orig
+        if roi[0] % step or roi[1] % step:
+            return None
+        id2version, computation = key
+        (cache_id, version), = id2version
+        for old_version in frame.damaged_versions():
+            region = frame.damage_since(old_version)
+            if region is None:
+                continue
+            # versions only go up, so nobody will look for the old thumbnail again and we can update it in place
+            thumbnail = cache.take((((cache_id, old_version),), computation))
+            if thumbnail is not None:
+                frame.patch_thumbnail(thumbnail, region, roi, inv_scale, step)
+                return thumbnail
+        return None
+
     def clear_cache(self):
         layout.drawing_area().clear_fading_mask()
+        layout.drawing_area().clear_playback_ring()
 
     def seek_frame_and_layer(self,pos,layer_pos):
         assert pos >= 0 and pos < len(self.frames)
@@ -3697,12 +4837,14 @@ class Movie(MovieData):
             frame.id = frame_id
             frame.hold = layer is not self.layers[self.layer_pos] # by default, hold the other layers' frames
             layer.frames.insert(self.pos+1, frame)
+        self.composition_changed()
         self.next_frame()
 
     def insert_layer(self):
         frames = [Frame(self.dir, None, frame.id) for frame in self.frames]
         layer = Layer(frames, self.dir)
         self.layers.insert(self.layer_pos+1, layer)
+        self.composition_changed()
         self.next_layer()
 
     def reinsert_frame_at_pos(self, pos, removed_frame_data):
@@ -3719,6 +4861,7 @@ class Movie(MovieData):
             layer.frames.insert(self.pos, frame)
             frame.save()
 
+        self.composition_changed()
         self.clear_cache()
         self.save_meta()
 
@@ -3732,6 +4875,7 @@ class Movie(MovieData):
         self.layers.insert(self.layer_pos, removed_layer)
         removed_layer.undelete()
 
+        self.composition_changed()
         self.clear_cache()
         self.save_meta()
 
@@ -3739,6 +4883,7 @@ class Movie(MovieData):
         if len(self.frames) <= 1:
             return
 
+        self.composition_changed()
         self.clear_cache()
 
         if at_pos == -1:
@@ -3777,6 +4922,7 @@ class Movie(MovieData):
         if len(self.layers) <= 1:
             return
 
+        self.composition_changed()
         self.clear_cache()
 
         if at_pos == -1:
@@ -3809,8 +4955,20 @@ class Movie(MovieData):
         f = self.frame(self.pos)
         f.increment_version()
         self.edited_since_export = True
+
+        # drop the signatures of the positions showing this frame - their cache keys reference its old version
+        layer = self.curr_layer()
+        pos = layer.surface_pos(self.pos)
+        while True:
+            self.pos2signature.pop(pos, None)
+            pos += 1
+            if pos == len(layer.frames) or not layer.frames[pos].hold:
+                break
         return f
 
+    # MovieData is also used by the export process, which doesn't load tinylib
+    def _blit_surfaces(self, s, surfaces): blend_layers(s, surfaces)
+
     def _set_undrawable_layers_grid(self, s, color, x=0, y=0):
         alpha = pg.surfarray.pixels3d(s)
         color = np.array(color)
@@ -3819,14 +4977,14 @@ class Movie(MovieData):
         alpha[x::WIDTH*3, y+1::WIDTH*3, :] = color
         alpha[x+1::WIDTH*3, y+1::WIDTH*3, :] = color
 
-    def curr_bottom_layers_surface(self, pos, highlight, width=None, height=None, roi=None, inv_scale=None, subset=None):
+    def curr_bottom_layers_surface(self, pos, highlight, width=None, height=None, roi=None, inv_scale=None, subset=None, key=False, background=False):
         if not width and not inv_scale: width=IWIDTH
         if not height and not inv_scale: height=IHEIGHT
         if not roi: roi=(0, 0, IWIDTH, IHEIGHT)
 
         class CachedBottomLayers:
             def compute_key(_):
-                return self._visible_layers_id2version(self.layers[:self.layer_pos], pos), ('blit-bottom-layers' if not highlight else 'bottom-layers-highlighted', width, height, roi, inv_scale, subset)
+                return self._visible_layers_id2version(pos, 0, self.layer_pos), ('blit-bottom-layers' if not highlight else 'bottom-layers-highlighted', width, height, roi, inv_scale, subset)
             def compute_value(_):
                 layers = self._blit_layers(self.layers[:self.layer_pos], pos, transparent=True, width=width, height=height, roi=roi, inv_scale=inv_scale)
                 s = pg.Surface((layers.get_width(), layers.get_height()), pg.SRCALPHA)
@@ -3834,41 +4992,33 @@ class Movie(MovieData):
                 if self.layer_pos == 0:
                     return s
                 if not highlight:
-                    s.blit(layers, (0, 0))
+                    blend_layers(s, [layers])
                     return s
 
                 layers.set_alpha(128)
-                da = layout.drawing_area()
-                w, h = da.iwidth+da.xmargin*2+128, da.iheight+da.ymargin*2+128
-                class BelowImage:
-                    def compute_key(_): return tuple(), ('below-image', w, h)
-                    def compute_value(_):
-                        below_image = pg.Surface((w, h), pg.SRCALPHA)
-                        below_image.set_alpha(128)
-                        below_image.fill(LAYERS_BELOW)
-                        return below_image
-                rgba = np.copy(rgba_array(layers)[0]) # funnily enough, this is much faster than calling array_alpha()
-                # to save a copy of just the alpha pixels [those we really need]...
-                layers.blit(cache.fetch(BelowImage()), (0,0))
-                rgba_array(layers)[0][:,:,3] = rgba[:,:,3]
+                blend_color(layers, LAYERS_BELOW, 128, keep_alpha=True)
                 if subset is not None:
                     s = s.subsurface(subset)
                     layers = layers.subsurface(subset)
                 self._set_undrawable_layers_grid(layers, (0,0,255))
-                s.blit(layers, (0,0))
+                blend_layers(s, [layers])
 
                 return s
 
+        if key:
+            return CachedBottomLayers().compute_key()
+        if background:
+            return background_pool.fetch(CachedBottomLayers(), lambda: self.curr_bottom_layers_surface(pos, highlight, width, height, roi, inv_scale, subset, key=True), prefetch=True)
         return cache.fetch(CachedBottomLayers())
 
-    def curr_top_layers_surface(self, pos, highlight, width=None, height=None, roi=None, inv_scale=None, subset=None):
+    def curr_top_layers_surface(self, pos, highlight, width=None, height=None, roi=None, inv_scale=None, subset=None, key=False, background=False):
         if not width and not inv_scale: width=IWIDTH
         if not height and not inv_scale: height=IHEIGHT
         if not roi: roi=(0, 0, IWIDTH, IHEIGHT)
 
         class CachedTopLayers:
             def compute_key(_):
-                return self._visible_layers_id2version(self.layers[self.layer_pos+1:], pos), ('blit-top-layers' if not highlight else 'top-layers-highlighted', width, height, roi, inv_scale, subset)
+                return self._visible_layers_id2version(pos, self.layer_pos+1), ('blit-top-layers' if not highlight else 'top-layers-highlighted', width, height, roi, inv_scale, subset)
             def compute_value(_):
                 layers = self._blit_layers(self.layers[self.layer_pos+1:], pos, transparent=True, width=width, height=height, roi=roi, inv_scale=inv_scale)
                 if not highlight or self.layer_pos == len(self.layers)-1:
@@ -3877,27 +5027,23 @@ class Movie(MovieData):
                 layers.set_alpha(128)
                 s = pg.Surface((layers.get_width(), layers.get_height()), pg.SRCALPHA)
                 s.fill(BACKGROUND)
-                da = layout.drawing_area()
-                w, h = da.iwidth+da.xmargin*2 + 128, da.iheight+da.ymargin*2 + 128 #TODO: what should this really be? 128 is 2x max alignment step but in what space?..
-                class AboveImage:
-                    def compute_key(_): return tuple(), ('above-image', w, h)
-                    def compute_value(_):
-                        above_image = pg.Surface((w, h), pg.SRCALPHA)
-                        above_image.set_alpha(128)
-                        above_image.fill(LAYERS_ABOVE)
-                        return above_image
                 if subset is not None:
                     s = s.subsurface(subset)
                     layers = layers.subsurface(subset)
-                rgba = np.copy(rgba_array(layers)[0])
-                layers.blit(cache.fetch(AboveImage()), (0,0))
+                rgba = np.copy(rgba_array(layers)[0]) # funnily enough, this is much faster than calling array_alpha()
+                # to save a copy of just the alpha pixels [those we really need]...
+                blend_color(layers, LAYERS_ABOVE, 128)
                 self._set_undrawable_layers_grid(layers, (255,0,0), x=WIDTH*3//2, y=WIDTH**3//2)
-                s.blit(layers, (0,0))
+                blend_layers(s, [layers])
                 rgba_array(s)[0][:,:,3] = rgba[:,:,3]
                 s.set_alpha(192)
 
                 return s
 
+        if key:
+            return CachedTopLayers().compute_key()
+        if background:
+            return background_pool.fetch(CachedTopLayers(), lambda: self.curr_top_layers_surface(pos, highlight, width, height, roi, inv_scale, subset, key=True), prefetch=True)
         return cache.fetch(CachedTopLayers())
 
     def render_and_save_current_frame(self):
@@ -3940,11 +5086,18 @@ class Movie(MovieData):
 
         self.render_and_save_current_frame()
         self.garbage_collect_layer_dirs()
+        self.retire_frames()
+
+    def retire_frames(self):
+        for layer in self.layers:
+            for frame in layer.frames:
+                frame.retire()
 
     def fit_to_resolution(self):
         for layer in self.layers:
             for frame in layer.frames:
                 frame.fit_to_resolution()
+        self.composition_changed()
 
     def delete(self): self.rename(movie.dir + '-deleted')
     def rename(self, new_path):
@@ -4021,6 +5174,7 @@ class ToggleHistoryItem(HistoryItemBase):
         self.toggle_func = toggle_func
     def undo(self):
         self.toggle_func()
+        movie.composition_changed()
         return self
     def __str__(self):
         return f'ToggleHistoryItem({self.toggle_func.__qualname__})'
@@ -4159,6 +5313,7 @@ def toggle_layer_lock():
     layer = movie.curr_layer()
     layer.toggle_locked()
     history.append_item(ToggleHistoryItem(layer.toggle_locked))
+    layout.drawing_area().clear_playback_ring()
 
 def zoom_to_film_res():
     pos = QCursor.pos()
@@ -4213,6 +5368,7 @@ def set_tool(tool):
     if tool.cursor:
         try_set_cursor(tool.cursor[0])
     tool_change += 1
+    PaintBucketTool.prefetch_regions()
 
 def restore_tool():
     set_tool(prev_tool)
@@ -4570,12 +5726,14 @@ PLAYBACK_TIMER_EVENT = user_event()
 SAVING_TIMER_EVENT = user_event() 
 FADING_TIMER_EVENT = user_event()
 HISTORY_TIMER_EVENT = user_event()
+BACKGROUND_POOL_EVENT = user_event() # BackgroundPool computed something
 
 timer_events = [
     PLAYBACK_TIMER_EVENT,
     SAVING_TIMER_EVENT,
     FADING_TIMER_EVENT,
     HISTORY_TIMER_EVENT,
+    BACKGROUND_POOL_EVENT,
 ]
 
 interesting_events = [
@@ -4779,11 +5937,16 @@ def process_keydown_event(event):
 #pygame.display.flip()
 
 class TinymationWidget(QWidget):
+    background_pool_done = Signal() # emitted in a worker thread, and delivered in the main thread
+
     def __init__(self):
         super().__init__()
         self.initUI()
         self.eraser = False
         self.lineWidth = 2.5
+        self.layout_redraw_scheduled = False
+        self.queued_motion = []
+        self.motion_received_ns = None # when the oldest mouse move not yet painted was received
 
     def initUI(self):
         self.setWindowTitle('Tinymation')
@@ -4793,21 +5956,13 @@ class TinymationWidget(QWidget):
         scr = QGuiApplication.primaryScreen().geometry()
         self.setGeometry(scr)
         
-        # Create backing store QImage with the scr size
-        self.image = QImage(scr.size(), QImage.Format.Format_RGB32)
+        # the backing store QImage shares its pixels with the screen surface
+        self.image = screen_image
         self.sz = scr.size()
-        self.image.fill(Qt.black)
-        pgsurf2qtimage(screen, self.image)
         
         # Enable tablet tracking
         #self.setAttribute(Qt.WidgetAttribute.WA_TabletTracking)
 
-        mem_view = self.image.bits()
-        self.address = ctypes.c_void_p(ctypes.addressof(ctypes.c_byte.from_buffer(mem_view))).value + 1
-
-        self.rect = np.zeros(4, dtype=np.int32)
-        self.region = arr_base_ptr(self.rect)
-
         self.timers = []
         # we save the current frame every 15 seconds
         for event, rate in ((PLAYBACK_TIMER_EVENT, 1000/FRAME_RATE), (SAVING_TIMER_EVENT, 15*1000), (FADING_TIMER_EVENT, 1000/FADING_RATE)):
@@ -4816,6 +5971,10 @@ class TinymationWidget(QWidget):
             timer.start(rate)
             self.timers.append(timer)
 
+        # the values computed in the background are collected as soon as they're ready
+        self.background_pool_done.connect(lambda: self.on_timer(BACKGROUND_POOL_EVENT), Qt.QueuedConnection)
+        background_pool.on_done = self.background_pool_done.emit
+
     def start_loading(self):
         load_clips_dir()
         global history
@@ -4826,6 +5985,7 @@ class TinymationWidget(QWidget):
     def on_timer(self, event):
         if layout is None:
             return
+        self.handleQueuedMotion()
         class Event: pass
         e = Event()
         e.type = event
@@ -4834,22 +5994,76 @@ class TinymationWidget(QWidget):
         self.redrawScreen()
 
     def redrawScreen(self):
-        pgsurf2qtimage(screen, self.image)
-        self.update()
+        # the pixels are already in self.image - we only need to repaint the ones that changed
+        region = screen_damage.take()
+        if region is not None:
+            self.update(region)
 
     def redrawLayoutIfNeeded(self, event=None):
         if event is None or (layout.is_playing and event.type == PLAYBACK_TIMER_EVENT) or (layout.drawing_area().fading_mask and event.type == FADING_TIMER_EVENT) or event.type not in timer_events:
-            layout.draw()
-            if not layout.is_playing:
-               cache.collect_garbage()
+            self.scheduleLayoutRedraw()
+
+    def scheduleLayoutRedraw(self):
+        # we don't redraw the layout inside the input event handlers. instead, we redraw it when a 0 ms timer fires,
+        # which happens after the events already queued are processed - so when the input comes in faster than
+        # we can redraw (say, a tablet sending events at 200 Hz while we scrub the timeline), the input handling
+        # doesn't lag behind a backlog of redraws; we skip the intermediate states and redraw the latest one
+        if not self.layout_redraw_scheduled:
+            self.layout_redraw_scheduled = True
+            QTimer.singleShot(0, self.redrawLayout)
+
+    def redrawLayout(self):
+        self.layout_redraw_scheduled = False
+        layout.draw()
+        if not layout.is_playing:
+           cache.collect_garbage()
+        self.redrawScreen()
 
     def paintEvent(self, event):
         painter = QPainter(self)
-        region = event.region()
-        rect = region.boundingRect()
-        painter.drawImage(rect, self.image, rect)
+        for rect in event.region():
+            painter.drawImage(rect, self.image, rect)
         painter.end()
         event.accept()
+        if self.motion_received_ns is not None:
+            # the input latency, from receiving a mouse move to showing its effect (minus the time it takes
+            # the compositor and the display to show what we painted)
+            motion_latency_timer.record(self.motion_received_ns)
+            self.motion_received_ns = None
+
+    def inputEvent(self, e, event):
+        e.received_ns = time.time_ns()
+        if e.type == pg.MOUSEMOTION and layout.is_pressed:
+            self.queueMotion(e)
+        else:
+            self.handleQueuedMotion() # the moves preceding this event must be handled before it
+            layout.on_event(e)
+            if e.type != pg.MOUSEMOTION: # moving without pressing (eg a hovering pen) changes nothing
+                self.redrawLayoutIfNeeded(event)
+            self.redrawScreen()
+        event.accept()
+
+    def queueMotion(self, e):
+        # mouse moves with a button pressed are queued and handled when a 0 ms timer fires, after the events
+        # already queued are delivered. when a tablet sends events faster than we handle them, this way we don't
+        # lag behind a backlog of events - we handle all the moves which came in meanwhile at once (PenTool paints
+        # them with a single tinylib call and updates the drawing area once), and then Qt repaints the window once
+        if not self.queued_motion:
+            QTimer.singleShot(0, self.handleQueuedMotion)
+        self.queued_motion.append(e)
+
+    def handleQueuedMotion(self):
+        if not self.queued_motion:
+            return # already handled before a button event
+        events = self.queued_motion
+        self.queued_motion = []
+        motion_wait_timer.record(events[0].received_ns)
+        with motion_batch_timer:
+            layout.on_mouse_moves(events)
+        if self.motion_received_ns is None:
+            self.motion_received_ns = events[0].received_ns
+        self.redrawLayoutIfNeeded()
+        self.redrawScreen()
 
     def mouseEvent(self, event, type):
         class Event:
@@ -4859,10 +6073,9 @@ class TinymationWidget(QWidget):
         pos = event.position()
         e.pos = (pos.x(), pos.y())
         e.subpixel = False
-        layout.on_event(e)
-        self.redrawLayoutIfNeeded(event)
-        self.redrawScreen()
-        event.accept()
+        e.time = event.timestamp()
+        e.pressure = 1
+        self.inputEvent(e, event)
 
     def mousePressEvent(self, event): self.mouseEvent(event, pg.MOUSEBUTTONDOWN)
     def mouseMoveEvent(self, event): self.mouseEvent(event, pg.MOUSEMOTION)
@@ -4880,14 +6093,9 @@ class TinymationWidget(QWidget):
         # where the cursor hotspot is (which isn't happening without this correction)
         e.pos = (pos.x()-.5, pos.y()-.5)
         e.subpixel = True
-        layout.on_event(e)
-        self.redrawLayoutIfNeeded(event)
-        self.redrawScreen()
-        event.accept()
-
-    def update_region(self):
-        xmin, ymin, xmax, ymax = self.rect
-        self.update(xmin, ymin, xmax, ymax)
+        e.time = event.timestamp()
+        e.pressure = event.pressure()
+        self.inputEvent(e, event)
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Escape:
@@ -4917,6 +6125,7 @@ class TinymationWidget(QWidget):
             movie_list.wait_for_all_exporting_to_finish()
         else:
             print('Shift-Escape pressed - skipping export to GIF and MP4!')
+        shared_frames.remove_stored()
 
 widget = TinymationWidget()
 try_set_cursor(pencil_cursor[0])
@@ -127,11 +127,95 @@ void ImagePainter::getROI(int* region)
     region[3] = _ymax;
 }
 
-//TODO: LUT
 double sigmoid(double x) { return 1 / (1 + exp(-x)); }
 
+//empirically, things get grainy below w=2 (say at 1.5), and at w=2,
+//the narrowest line width where we're guaranteed to have 255s all along it
+//for a 4-connected flood fill to be stopped by the line is 2.5
+const double lineEdgeWidth = 2;
+
+//the grey level of a pixel at the distance c from the edge of the line (c is in [-lineEdgeWidth, lineEdgeWidth],
+//negative inside the line)
+static int lineGrey(double c)
+{
+    const double w = lineEdgeWidth;
+    int grey = (1-sigmoid(c*6/w)) * 255;
+    if(grey >= 255 - 30) {
+        grey = 255;
+    }
+    return grey;
+}
+
+//lineGrey() is a step function of c, decreasing from 255 to 0. rather than calling exp() per pixel, we find the points
+//where it steps down (exactly - the largest double at which it still has the higher value), and look up the steps
+//near c in a table indexed by c
+class LineGreyLUT
+{
+  public:
+    LineGreyLUT()
+    {
+        const double w = lineEdgeWidth;
+        //the steps are at least 1/200 apart, so we can't miss one when sampling more densely than that
+        const int samples = 40000;
+        double prev = -w;
+        for(int i=1; i<=samples; ++i) {
+            double c = i==samples ? w : -w + 2*w*i/samples;
+            if(lineGrey(c) == lineGrey(prev)) {
+                prev = c;
+                continue;
+            }
+            //bisect to find the step between prev & c
+            double lo = prev, hi = c;
+            while(true) {
+                double mid = lo + (hi - lo) / 2;
+                if(mid <= lo || mid >= hi) {
+                    break;
+                }
+                if(lineGrey(mid) == lineGrey(prev)) {
+                    lo = mid;
+                }
+                else {
+                    hi = mid;
+                }
+            }
+            _steps.push_back(lo);
+            _greys.push_back(lineGrey(prev));
+            prev = c;
+        }
+        _greys.push_back(lineGrey(w));
+        _steps.push_back(w); //never above c since c is clamped to [-w,w]
+
+        //_first[i] is the index of the first step at or above the beginning of the i-th bin, minus 1 for safety
+        //against rounding in bin()
+        for(int i=0; i<bins; ++i) {
+            double binStart = -w + 2*w*i/bins;
+            int first = std::lower_bound(_steps.begin(), _steps.end(), binStart) - _steps.begin();
+            _first[i] = std::max(0, first - 1);
+        }
+    }
+
+    int grey(double c) const
+    {
+        int i = _first[bin(c)];
+        while(c > _steps[i]) {
+            ++i;
+        }
+        return _greys[i];
+    }
+
+  private:
+    static const int bins = 1024;
+    int _first[bins];
+    std::vector<double> _steps; //the largest c at which the grey level is still _greys[i]
+    std::vector<int> _greys;
+
+    static int bin(double c) { return std::min(bins-1, std::max(0, (int)((c + lineEdgeWidth) * (bins / (2*lineEdgeWidth))))); }
+};
+
 void ImagePainter::drawLine(const Point2D& start, const Point2D& end, double width)
 {
+    static const LineGreyLUT lineGreyLUT;
+
     double lineMag = distance(start, end);
     double invSqLineMag = 1/(lineMag*lineMag);
     Point2D d = diff(end, start);
@@ -158,21 +242,36 @@ void ImagePainter::drawLine(const Point2D& start, const Point2D& end, double wid
     int endy = ceil(std::max(start.y,end.y) + width);
     double halfWidth = width * 0.5;
 
-    double w = 2; //empirically, things get grainy below w=2 (say at 1.5), and at w=2,
-    //the narrowest line width where we're guaranteed to have 255s all along it
-    //for a 4-connected flood fill to be stopped by the line is 2.5
+    double w = lineEdgeWidth;
+    double maxDist = halfWidth+w+1; //pixels further away than this are left as is
 
     //we can't erase an already fully-erased pixel, or strengthen an already-strongest-possible one
     int immutableVal = _erase ? 0 : 255;
 
-    for(int y = starty; y < endy; y++) {
-        if(y < 0 || y >= _height) {
+    for(int y = std::max(starty, 0); y < std::min(endy, _height); y++) {
+        //rather than going over all the pixels in the bounding box, we only look at those in the band around the
+        //line segment. the segment points within maxDist from this row are those at the parameter values t in
+        //[tmin,tmax], and the pixels within maxDist from them are within maxDist from the x coordinates of the ends
+        //of this part of the segment (this is conservative; we check the actual distance below)
+        double tmin = 0, tmax = 1;
+        if(fabs(d.y) > 1e-8) {
+            double t1 = (y - maxDist - start.y) / d.y;
+            double t2 = (y + maxDist - start.y) / d.y;
+            tmin = std::max(0.0, std::min(t1, t2));
+            tmax = std::min(1.0, std::max(t1, t2));
+        }
+        else if(fabs(y - start.y) > maxDist + 1) {
             continue;
         }
-        for(int x = startx; x < endx; x++) {
-            if(x < 0 || x >= _width) {
-                continue;
-            }
+        if(tmin > tmax + 1e-8) {
+            continue;
+        }
+        double x1 = start.x + d.x*tmin;
+        double x2 = start.x + d.x*tmax;
+        int bandStart = std::max({startx, 0, (int)floor(std::min(x1, x2) - maxDist) - 1});
+        int bandEnd = std::min({endx, _width, (int)ceil(std::max(x1, x2) + maxDist) + 2});
+
+        for(int x = bandStart; x < bandEnd; x++) {
             int ind = y*_ystride + x*_xstride;
             int oldVal = _image[ind];
             if(oldVal == immutableVal) {
@@ -180,16 +279,12 @@ void ImagePainter::drawLine(const Point2D& start, const Point2D& end, double wid
             }
             double dist = distFromLine({(double)x,(double)y});
 
-            if(dist > halfWidth+w+1) {
+            if(dist > maxDist) {
                 continue;
             }
 
-            int grey = 255;
             double c = std::max(-w, std::min(w, dist - halfWidth));
-            grey = (1-sigmoid(c*6/w)) * 255;
-            if(grey >= 255 - 30) {
-                grey = 255;
-            }
+            int grey = lineGreyLUT.grey(c);
             int newVal;
             if(_erase) {
                 newVal = std::min(255-grey, oldVal);
@@ -517,13 +612,33 @@ void Brush::paintAt(const SamplePoint& p)
 
 //extern "C" API
 
-extern "C" Brush* brush_init_paint(double x, double y, double time, double lineWidth, double smoothDist, int erase, unsigned char* image, int width, int height, int xstride, int ystride)
+//an input device sample: the position, the time in ms (as in Qt event timestamps) and the pressure between 0 and 1
+//(1 for a mouse.) the samples are passed to the functions below in arrays of these
+struct BrushSample
+{
+    double x, y;
+    double time;
+    double pressure;
+};
+
+static SamplePoint samplePoint(const BrushSample& s)
+{
+    SamplePoint p;
+    p.pos = Point2D{s.x, s.y};
+    p.time = s.time;
+    p.pressure = s.pressure;
+    return p;
+}
+
+extern "C" Brush* brush_init_paint(const BrushSample* sample, double lineWidth, double smoothDist, int erase, unsigned char* image, int width, int height, int xstride, int ystride)
 {
     Brush& brush = *new Brush;
     brush._smoothing = Smoothing::WEIGHTED;
     brush._lineWidth = lineWidth;
     brush._smoothDist = smoothDist;
-    brush._tailAggressiveness = 0; //since we don't have pressure values, this parameter has no effect anyway
+    //Krita's default; this makes the smoothing follow the pen more closely as the pressure drops when lifting it,
+    //so the line doesn't "lag behind" the pen at its end (has no effect with a constant pressure, as with a mouse)
+    brush._tailAggressiveness = 0.15;
     
     ImagePainter& painter = *new ImagePainter;
     painter._image = image;
@@ -534,21 +649,41 @@ extern "C" Brush* brush_init_paint(double x, double y, double time, double lineW
     painter._erase = erase;
     brush._painter = &painter;
 
-    brush.initPaint({{x,y},time});
+    brush.initPaint(samplePoint(*sample));
 
     return &brush;
 }
 
-extern "C" void brush_paint(Brush* brush, double* x, double* y, double time, double zoom, int* region)
+//the sample's x & y are updated to the smoothed position
+extern "C" void brush_paint(Brush* brush, BrushSample* sample, double zoom, int* region)
 {
-    SamplePoint s{{*x,*y},time};
+    SamplePoint s = samplePoint(*sample);
     brush->_painter->resetROI();
     brush->paint(s, zoom);
-    *x = s.pos.x;
-    *y = s.pos.y;
+    sample->x = s.pos.x;
+    sample->y = s.pos.y;
     brush->_painter->getROI(region);
 }
 
+//brush_paint() for n samples in one call. region gets the bounding box of everything painted; if regions isn't null,
+//it gets the bounding box of what each sample painted (4 ints per sample)
+extern "C" void brush_paint_many(Brush* brush, BrushSample* samples, int n, double zoom, int* region, int* regions)
+{
+    int total[4] = {1000000, 1000000, -1, -1};
+    for(int i=0; i<n; ++i) {
+        int point_region[4];
+        brush_paint(brush, samples+i, zoom, point_region);
+        if(regions) {
+            std::copy(point_region, point_region+4, regions+i*4);
+        }
+        total[0] = std::min(total[0], point_region[0]);
+        total[1] = std::min(total[1], point_region[1]);
+        total[2] = std::max(total[2], point_region[2]);
+        total[3] = std::max(total[3], point_region[3]);
+    }
+    std::copy(total, total+4, region);
+}
+
 extern "C" void brush_end_paint(Brush* brush, int* region)
 {
     brush->_painter->resetROI();
@@ -0,0 +1,230 @@
+#include <cstdint>
+#include <vector>
+#include <thread>
+#include <algorithm>
+#ifdef __SSE2__
+#include <emmintrin.h>
+#endif
+
+// these functions produce exactly the pixels pygame produces when blitting a surface with per-pixel alpha
+// (and optionally, a surface alpha) onto a surface with per-pixel alpha (see ALPHA_BLEND in pygame's surface.h.)
+// the channel order doesn't matter as long as all the images have the same one; the alpha is always the last byte
+// of a pixel (see tinylib.cpp)
+
+static inline void alpha_blend(int sr, int sg, int sb, int sa, unsigned char* d)
+{
+    int da = d[3];
+    if(da) {
+        d[0] = (((sr - d[0]) * sa + sr) >> 8) + d[0];
+        d[1] = (((sg - d[1]) * sa + sg) >> 8) + d[1];
+        d[2] = (((sb - d[2]) * sa + sb) >> 8) + d[2];
+        d[3] = sa + da - (sa * da) / 255;
+    }
+    else {
+        d[0] = sr;
+        d[1] = sg;
+        d[2] = sb;
+        d[3] = sa;
+    }
+}
+
+//x/255 for x in [0, 255*255], without a division
+static inline uint16_t div255(uint16_t x)
+{
+    return (x + 1 + (x >> 8)) >> 8;
+}
+
+//alpha_blend() on pixels read as 32b ints, without branches and in 16b arithmetic (so the compiler can vectorize
+//loops calling it into 8 channels per instruction.) the 16b products overflow, but the byte we keep is still exact
+static inline uint32_t blend_pixel(uint32_t s, uint16_t alpha, uint32_t d)
+{
+    uint16_t sa = div255((s >> 24) * alpha);
+    uint16_t da = d >> 24;
+    uint32_t out = 0;
+    for(int c=0; c<24; c+=8) {
+        uint16_t sc = (s >> c) & 255;
+        uint16_t dc = (d >> c) & 255;
+        uint16_t blended = ((uint16_t)((uint16_t)(sc - dc) * sa + sc) >> 8) + dc;
+        out |= (uint32_t)((da ? blended : sc) & 255) << c;
+    }
+    uint16_t oa = da ? sa + da - div255(sa * da) : sa;
+    return out | ((uint32_t)oa << 24);
+}
+
+//calls f(start_row, end_row) from several threads for large images
+template<class F>
+static void for_row_ranges(int width, int height, F f)
+{
+    const int min_pixels_per_thread = 256*1024;
+    int nthreads = std::min(std::min((int)std::thread::hardware_concurrency(), 8), (int)((long long)width*height / min_pixels_per_thread));
+    if(nthreads <= 1) {
+        f(0, height);
+        return;
+    }
+    int rows = (height + nthreads - 1) / nthreads;
+    std::vector<std::thread> threads;
+    for(int start=rows; start<height; start+=rows) {
+        threads.emplace_back(f, start, std::min(height, start+rows));
+    }
+    f(0, std::min(height, rows));
+    for(auto& t : threads) {
+        t.join();
+    }
+}
+
+#ifdef __SSE2__
+static inline __m128i div255_epi16(__m128i x)
+{
+    return _mm_srli_epi16(_mm_add_epi16(_mm_add_epi16(x, _mm_set1_epi16(1)), _mm_srli_epi16(x, 8)), 8);
+}
+
+//blend_pixel() on 2 pixels unpacked into 16b channels
+static inline __m128i blend_pixels(__m128i s, __m128i d, __m128i alpha)
+{
+    const __m128i amask = _mm_set_epi16(-1,0,0,0,-1,0,0,0); //the alpha channels of the 2 pixels
+    __m128i sa = div255_epi16(_mm_mullo_epi16(_mm_shufflehi_epi16(_mm_shufflelo_epi16(s, 0xff), 0xff), alpha));
+    __m128i da = _mm_shufflehi_epi16(_mm_shufflelo_epi16(d, 0xff), 0xff);
+    __m128i blended = _mm_add_epi16(_mm_srli_epi16(_mm_add_epi16(_mm_mullo_epi16(_mm_sub_epi16(s, d), sa), s), 8), d);
+    __m128i oa = _mm_sub_epi16(_mm_add_epi16(sa, da), div255_epi16(_mm_mullo_epi16(sa, da)));
+    __m128i over = _mm_or_si128(_mm_and_si128(amask, oa), _mm_andnot_si128(amask, blended));
+    __m128i copy = _mm_or_si128(_mm_and_si128(amask, sa), _mm_andnot_si128(amask, s));
+    __m128i transparent = _mm_cmpeq_epi16(da, _mm_setzero_si128());
+    __m128i out = _mm_or_si128(_mm_and_si128(transparent, copy), _mm_andnot_si128(transparent, over));
+    return _mm_and_si128(out, _mm_set1_epi16(255));
+}
+#endif
+
+//alpha-blends n pixels of src onto dst
+static void blend_run(uint32_t* dst, const uint32_t* src, int n, uint32_t alpha)
+{
+    int x = 0;
+#ifdef __SSE2__
+    const __m128i zero = _mm_setzero_si128();
+    __m128i alpha16 = _mm_set1_epi16(alpha);
+    for(; x+4<=n; x+=4) {
+        __m128i s = _mm_loadu_si128((const __m128i*)(src+x));
+        __m128i d = _mm_loadu_si128((const __m128i*)(dst+x));
+        __m128i lo = blend_pixels(_mm_unpacklo_epi8(s, zero), _mm_unpacklo_epi8(d, zero), alpha16);
+        __m128i hi = blend_pixels(_mm_unpackhi_epi8(s, zero), _mm_unpackhi_epi8(d, zero), alpha16);
+        _mm_storeu_si128((__m128i*)(dst+x), _mm_packus_epi16(lo, hi));
+    }
+#endif
+    for(; x<n; ++x) {
+        dst[x] = blend_pixel(src[x], alpha, dst[x]);
+    }
+}
+
+//true if blending src onto dst leaves dst as is (src is transparent and dst is not - if dst is transparent,
+//its color is replaced even by a transparent pixel, as pygame does)
+static bool blend_is_nop(const uint32_t* dst, const uint32_t* src, int n)
+{
+    uint32_t any_src = 0;
+    uint32_t min_dst = 255;
+    for(int x=0; x<n; ++x) {
+        any_src |= src[x];
+        min_dst = std::min(min_dst, dst[x] >> 24);
+    }
+    return !(any_src >> 24) && min_dst;
+}
+
+//blits the layers onto dst, in order, in a single pass over the pixels. layer_alphas are the surface alphas
+//(255 for surfaces without one.) the layers must be at least as large as dst
+extern "C" void blend_layers(unsigned char* dst, int dst_stride, int width, int height,
+                             unsigned char** layers, int* layer_strides, int* layer_alphas, int nlayers)
+{
+    //most of a layer is usually transparent, so we look at it in chunks, skipping the ones with nothing to blend
+    const int chunk = 64;
+    for_row_ranges(width, height, [=](int start, int end) {
+        for(int y=start; y<end; ++y) {
+            uint32_t* drow = (uint32_t*)(dst + dst_stride*y);
+            for(int i=0; i<nlayers; ++i) {
+                const uint32_t* lrow = (const uint32_t*)(layers[i] + layer_strides[i]*y);
+                for(int x=0; x<width; x+=chunk) {
+                    int n = std::min(chunk, width-x);
+                    if(!blend_is_nop(drow+x, lrow+x, n)) {
+                        blend_run(drow+x, lrow+x, n, layer_alphas[i]);
+                    }
+                }
+            }
+        }
+    });
+}
+
+//blends a color with the given alpha over the image in place, same as blitting a surface filled with the color
+//and with this surface alpha would. if keep_alpha is set, the alpha channel of the image is left as is
+extern "C" void blend_color(unsigned char* img, int stride, int width, int height, int color, int alpha, int keep_alpha)
+{
+    int r = color & 255;
+    int g = (color >> 8) & 255;
+    int b = (color >> 16) & 255;
+    for_row_ranges(width, height, [=](int start, int end) {
+        for(int y=start; y<end; ++y) {
+            unsigned char* row = img + stride*y;
+            for(int x4=0; x4<width*4; x4+=4) {
+                unsigned char* d = row + x4;
+                int a = d[3];
+                alpha_blend(r, g, b, alpha, d);
+                if(keep_alpha) {
+                    d[3] = a;
+                }
+            }
+        }
+    });
+}
+
+//updates the light table mask alpha of a frame with one of its layers: hides the pixels covered by the layer's
+//color and, if lines_lit is set, exposes the pixels covered by its lines. color & lines point to the alpha bytes
+//of 32b pixels; alpha is 8b
+extern "C" void update_mask_alpha(unsigned char* alpha, int alpha_stride, const unsigned char* lines, int lines_stride,
+                                  const unsigned char* color, int color_stride, int width, int height, int lines_lit)
+{
+    for_row_ranges(width, height, [=](int start, int end) {
+        for(int y=start; y<end; ++y) {
+            unsigned char* arow = alpha + alpha_stride*y;
+            const unsigned char* lrow = lines + lines_stride*y;
+            const unsigned char* crow = color + color_stride*y;
+            if(lines_lit) {
+                for(int x=0; x<width; ++x) {
+                    arow[x] = std::max(lrow[x*4], std::min((unsigned char)(255-crow[x*4]), arow[x]));
+                }
+            }
+            else {
+                for(int x=0; x<width; ++x) {
+                    arow[x] = std::min((unsigned char)(255-crow[x*4]), arow[x]);
+                }
+            }
+        }
+    });
+}
+
+//fills dst with colors[0] and the per-pixel alpha in alphas[0], then blends each of the other colors over it with
+//the per-pixel alpha in the respective plane - the same pixels we get by filling surfaces with these colors & alphas
+//and blitting them onto a copy of the first one. the alpha planes are 8b
+extern "C" void blend_alpha_masks(unsigned char* dst, int dst_stride, int width, int height,
+                                  unsigned char** alphas, int* alpha_strides, int* colors, int nmasks)
+{
+    const int chunk = 64;
+    for_row_ranges(width, height, [=](int start, int end) {
+        std::vector<uint32_t> src(width);
+        for(int y=start; y<end; ++y) {
+            uint32_t* drow = (uint32_t*)(dst + dst_stride*y);
+            for(int i=0; i<nmasks; ++i) {
+                const unsigned char* arow = alphas[i] + alpha_strides[i]*y;
+                uint32_t color = colors[i] & 0xffffff;
+                uint32_t* srow = i ? src.data() : drow;
+                for(int x=0; x<width; ++x) {
+                    srow[x] = color | ((uint32_t)arow[x] << 24);
+                }
+                if(i == 0) {
+                    continue;
+                }
+                for(int x=0; x<width; x+=chunk) {
+                    int n = std::min(chunk, width-x);
+                    if(!blend_is_nop(drow+x, srow+x, n)) {
+                        blend_run(drow+x, srow+x, n, 255);
+                    }
+                }
+            }
+        }
+    });
+}
@@ -1,5 +1,6 @@
 #include <vector>
 #include <algorithm>
+#include <cmath>
 
 struct FFillSegment
 {
@@ -46,11 +47,13 @@ enum
 }
 
 
-//the mask is a "native" numpy array so there's no stride of 4 between
-//values like in images returned by pixels_alpha()
-extern "C" void flood_fill_mask(unsigned char* mask, int mask_stride,
+//flood_fill_mask(), also calling fill_span(y, left, right) for every horizontal span of pixels it fills
+//(the spans don't overlap, and left & right are inclusive) - so that the caller can do something with the filled
+//pixels without scanning the mask for them
+template<class F>
+static void flood_fill_mask_spans(unsigned char* mask, int mask_stride,
 	       int width, int height, int seed_x, int seed_y, int mask_new_val,
-	       int* region, int _8_connectivity) 
+	       int* region, int _8_connectivity, F fill_span)
 {
     std::vector<FFillSegment> buf;
     std::vector<FFillSegment>* buffer = &buf;
@@ -78,6 +81,7 @@ extern "C" void flood_fill_mask(unsigned char* mask, int mask_stride,
     XMax = --R;
     XMin = ++L;
 
+    fill_span( seed_y, L, R );
     ICV_PUSH( seed_y, L, R, R + 1, R, UP );
 
     while( head != tail )
@@ -125,6 +129,7 @@ extern "C" void flood_fill_mask(unsigned char* mask, int mask_stride,
                         img[i] = mask_new_val;
 		    }
 
+                    fill_span( YC + dir, j+1, i-1 );
                     ICV_PUSH( YC + dir, j+1, i-1, L, R, -dir );
                 }
             }
@@ -140,6 +145,16 @@ extern "C" void flood_fill_mask(unsigned char* mask, int mask_stride,
     }
 }
 
+//the mask is a "native" numpy array so there's no stride of 4 between
+//values like in images returned by pixels_alpha()
+extern "C" void flood_fill_mask(unsigned char* mask, int mask_stride,
+	       int width, int height, int seed_x, int seed_y, int mask_new_val,
+	       int* region, int _8_connectivity) 
+{
+    flood_fill_mask_spans(mask, mask_stride, width, height, seed_x, seed_y, mask_new_val, region, _8_connectivity,
+                          [](int y, int left, int right) {});
+}
+
 extern "C" void fill_color_based_on_mask(int* color, const unsigned char* mask,
 		int color_stride, int mask_stride, int width, int height,
 		const int* region, int new_color_value, int mask_value)
@@ -160,41 +175,128 @@ extern "C" void fill_color_based_on_mask(int* color, const unsigned char* mask,
 	}
 }
 
+//calls f(x, y) for the integer points inside the image within the given distance from the line segment (x1, y1)-(x2, y2).
+//the distances are computed exactly as the paint bucket used to compute them in numpy, so we get the same points
+template<class F>
+static void for_points_near_segment(int width, int height, double x1, double y1, double x2, double y2, double distance, F f)
+{
+	int xmin = std::max(0.0, std::floor(std::min(x1, x2) - distance));
+	int xmax = std::min(width - 1.0, std::ceil(std::max(x1, x2) + distance));
+	int ymin = std::max(0.0, std::floor(std::min(y1, y2) - distance));
+	int ymax = std::min(height - 1.0, std::ceil(std::max(y1, y2) + distance));
+
+	double dx = x2 - x1;
+	double dy = y2 - y1;
+	double line_mag = std::sqrt(dx*dx + dy*dy);
+	for(int y=ymin; y<=ymax; ++y) {
+		for(int x=xmin; x<=xmax; ++x) {
+			double ix = x1, iy = y1;
+			if(line_mag >= 1e-8) {
+				//project the point onto the segment
+				double u = ((x - x1)*dx + (y - y1)*dy) / (line_mag*line_mag);
+				u = std::min(1.0, std::max(0.0, u));
+				ix = x1 + u*dx;
+				iy = y1 + u*dy;
+			}
+			if(std::sqrt((x - ix)*(x - ix) + (y - iy)*(y - iy)) <= distance) {
+				f(x, y);
+			}
+		}
+	}
+}
+
 //mask is modified by this operation (the input is 1s where lines are and 0s where there aren't,
 //and we fill some of the 0s with 2s; though we get "2" is the mask_new_val parameter.)
-//the region we return is xmin, xmax, ymin, ymax [exclusive], differently
+//the region we return is xmin, ymin, xmax, ymax [exclusive], differently
 //from flood_fill_mask()
+static void flood_fill_color_from_seed(int* color, unsigned char* mask,
+		int color_stride, int mask_stride, int width, int height,
+		int* region, int _8_connectivity,
+		int mask_new_val, int new_color_value, int x, int y)
+{
+	if(x < 0 || y < 0 || x >= width || y >= height) {
+		return;
+	}
+	//don't fill regions already having the right color value (this also skips the seeds in the regions
+	//we've already filled); don't fill inside the lines
+	if(color[(color_stride/4)*y + x] == new_color_value || mask[mask_stride*y + x] == 1) {
+		return;
+	}
+	int curr_region[4];
+	//color the pixels as they're filled, rather than scanning the region's bounding box for them afterwards
+	//(which can be much larger than the region, eg for a thin diagonal one)
+	flood_fill_mask_spans(mask, mask_stride, width, height, x, y, mask_new_val, curr_region, _8_connectivity,
+		[=](int y, int left, int right) {
+			int* color_row = color + (color_stride/4)*y;
+			std::fill(color_row + left, color_row + right + 1, new_color_value);
+		});
+
+	region[0] = std::min(region[0], curr_region[0]);
+	region[1] = std::min(region[1], curr_region[1]);
+	region[2] = std::max(region[2], curr_region[2]+curr_region[0]);
+	region[3] = std::max(region[3], curr_region[3]+curr_region[1]);
+}
+
+static void init_region(int* region)
+{
+	region[0] = region[1] = 1000000;
+	region[2] = region[3] = -1;
+}
+
 extern "C" void flood_fill_color_based_on_mask_many_seeds(int* color, unsigned char* mask,
 		int color_stride, int mask_stride, int width, int height,
 		int* region, int _8_connectivity,
 		int mask_new_val, int new_color_value,
 		const int* seed_x, const int* seed_y, int num_seeds)
 {
-	region[0] = region[1] = 1000000;
-	region[2] = region[3] = -1;
-	int fills = 0;
+	init_region(region);
 	for(int i=0; i<num_seeds; ++i) {
-		int x = seed_x[i];
-		int y = seed_y[i];
-		if(x < 0 || y < 0 || x >= width || y >= height) {
-			continue;
-		}
-		//don't fill regions already having the right color value;
-		//don't fill inside the lines
-		if(color[(color_stride/4)*y + x] == new_color_value || mask[mask_stride*y + x] == 1) {
-			continue;
-		}
-		fills++;
-		int curr_region[4];
-		flood_fill_mask(mask, mask_stride, width, height, x, y, mask_new_val, curr_region, _8_connectivity);
-
-		fill_color_based_on_mask(color, mask, color_stride, mask_stride, width, height, curr_region, new_color_value, mask_new_val);
-
-		region[0] = std::min(region[0], curr_region[0]);
-		region[1] = std::min(region[1], curr_region[1]);
-		region[2] = std::max(region[2], curr_region[2]+curr_region[0]);
-		region[3] = std::max(region[3], curr_region[3]+curr_region[1]);
+		flood_fill_color_from_seed(color, mask, color_stride, mask_stride, width, height, region, _8_connectivity,
+			mask_new_val, new_color_value, seed_x[i], seed_y[i]);
 	}
 }
 
+//flood_fill_color_based_on_mask_many_seeds() with the seeds being the points within the given distance
+//from the line segment (x1, y1)-(x2, y2), without the caller having to compute them
+extern "C" void flood_fill_color_based_on_mask_near_segment(int* color, unsigned char* mask,
+		int color_stride, int mask_stride, int width, int height,
+		int* region, int _8_connectivity,
+		int mask_new_val, int new_color_value,
+		double x1, double y1, double x2, double y2, double distance)
+{
+	init_region(region);
+	for_points_near_segment(width, height, x1, y1, x2, y2, distance, [&](int x, int y) {
+		flood_fill_color_from_seed(color, mask, color_stride, mask_stride, width, height, region, _8_connectivity,
+			mask_new_val, new_color_value, x, y);
+	});
+}
 
+//fills the regions containing the points within the given distance from the line segment (x1, y1)-(x2, y2)
+//with new_color_value, skipping the points on the lines (labeled 0) and the ones already having this color -
+//the same pixels flood_fill_color_based_on_mask_near_segment() fills, but using precomputed regions (see FrameRegions
+//in tinymation.py): the spans of region i are the (y, left, right) triplets [inclusive] from first_span[i] to
+//first_span[i+1], and its bbox is xmin, ymin, xmax, ymax [inclusive]. the region we return is as in
+//flood_fill_color_based_on_mask_near_segment()
+extern "C" void fill_color_regions_near_segment(int* color, int color_stride, int width, int height,
+		const int* labels, int labels_stride, const int* spans, const int* first_span, const int* bboxes,
+		int* region, int new_color_value, double x1, double y1, double x2, double y2, double distance)
+{
+	init_region(region);
+	for_points_near_segment(width, height, x1, y1, x2, y2, distance, [&](int x, int y) {
+		int label = labels[(labels_stride/4)*y + x];
+		//once a region is filled, the color test skips the rest of its points
+		if(label == 0 || color[(color_stride/4)*y + x] == new_color_value) {
+			return;
+		}
+		for(int i=first_span[label]; i<first_span[label+1]; ++i) {
+			const int* span = spans + i*3;
+			int* color_row = color + (color_stride/4)*span[0];
+			std::fill(color_row + span[1], color_row + span[2] + 1, new_color_value);
+		}
+		const int* bbox = bboxes + label*4;
+		region[0] = std::min(region[0], bbox[0]);
+		region[1] = std::min(region[1], bbox[1]);
+		region[2] = std::max(region[2], bbox[2]+1);
+		region[3] = std::max(region[3], bbox[3]+1);
+	});
+}
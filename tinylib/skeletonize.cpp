@@ -4,6 +4,14 @@
 #include <cstring>
 #include <cstdio>
 #include <algorithm>
+#include <vector>
+#include <thread>
+#include <mutex>
+#include <condition_variable>
+#include <atomic>
+#ifdef _MSC_VER
+#include <intrin.h>
+#endif
 
 static const uint8_t lut[256] =
                             {0, 0, 0, 1, 0, 0, 1, 3, 0, 0, 3, 1, 1, 0,
@@ -26,74 +34,167 @@ static const uint8_t lut[256] =
                              0, 0, 3, 3, 0, 1, 0, 0, 0, 0, 2, 2, 0, 0,
                              2, 0, 0, 0};
 
-//note that this algorithm parallelizes decently over rows, but ATM tinylib doesn't use any parallelism
-extern "C" void skeletonize(const uint8_t* image, int im_stride, uint8_t* skeleton, int sk_stride, int width, int height) 
+//the threads working on an image wait here for each other at the end of every pass, and the last one to arrive
+//calls f() before letting the others go on
+class Barrier
 {
-    width += 2;
-    height += 2;
-	uint8_t* curr_skeleton = new uint8_t[width*height];
-	uint8_t* next_skeleton = new uint8_t[width*height]; 
-    memset(curr_skeleton, 0, width*height);
-    memset(next_skeleton, 0, width*height);
+  public:
+    explicit Barrier(int count) : _count(count) {}
 
-    for(int y=1; y<height-1; ++y) {
-        for(int x=1; x<width-1; ++x) {
-            int oft = y*width + x;
-            int pix = image[(y-1)*im_stride + x-1];
-            curr_skeleton[oft] = pix;
-            next_skeleton[oft] = pix;
+    template<class F>
+    void arrive_and_wait(F f)
+    {
+        std::unique_lock<std::mutex> lock(_mutex);
+        int generation = _generation;
+        if(++_arrived == _count) {
+            f();
+            _arrived = 0;
+            _generation++;
+            _cond.notify_all();
+        }
+        else {
+            _cond.wait(lock, [&] { return generation != _generation; });
         }
     }
+  private:
+    std::mutex _mutex;
+    std::condition_variable _cond;
+    int _count;
+    int _arrived = 0;
+    int _generation = 0;
+};
+
+//the image is kept as rows of bits, 64 pixels per word. a row is padded with a zero pixel on both sides (as in
+//the original algorithm) and with a zero word on both sides, so we can shift in the neighbors of the pixels at
+//the ends of a word without special cases; there's also a zero row above and below the image
+static inline uint64_t left_neighbors(const uint64_t* row, int w) { return (row[w] << 1) | (row[w-1] >> 63); }
+static inline uint64_t right_neighbors(const uint64_t* row, int w) { return (row[w] >> 1) | (row[w+1] << 63); }
+static inline int bit(uint64_t word, int b) { return (word >> b) & 1; }
+
+//the index of the lowest set bit; word must be non-zero
+static inline int lowest_bit(uint64_t word)
+{
+#ifdef _MSC_VER
+    unsigned long b;
+    _BitScanForward64(&b, word);
+    return (int)b;
+#else
+    return __builtin_ctzll(word);
+#endif
+}
+
+//the buffers are reused across calls since the flashlight calls this on every click
+static thread_local std::vector<uint64_t> curr_bits;
+static thread_local std::vector<uint64_t> next_bits;
 
-	int passes = 0;
+//the passes are split between threads working on bands of rows; each pass reads the result of the previous pass
+//and writes a separate buffer, so the threads only need to wait for each other between passes
+extern "C" void skeletonize(const uint8_t* image, int im_stride, uint8_t* skeleton, int sk_stride, int width, int height) 
+{
+    if(width <= 0 || height <= 0) {
+        return;
+    }
+    int words = (width + 2 + 63) / 64;
+    int row_words = words + 2;
+    curr_bits.assign(row_words*(height+2), 0);
+    next_bits.assign(row_words*(height+2), 0);
+    //(the other threads have their own, unused buffers, so they must get these pointers rather than the vectors)
+    uint64_t* curr_start = curr_bits.data() + 1;
+    uint64_t* next_start = next_bits.data() + 1;
 
-	int l = -1;
-	int r = +1;
-	int d = -width;
-	int u = +width;
+    const int min_pixels_per_thread = 128*1024;
+    int nthreads = std::max(1, std::min(std::min((int)std::thread::hardware_concurrency(), 8), (int)((long long)width*height / min_pixels_per_thread)));
+    int band = (height + nthreads - 1) / nthreads;
+    int nbands = (height + band - 1) / band;
 
-	bool pixel_removed = true;
+    Barrier barrier(nbands);
+    std::atomic<bool> pixel_removed(false);
+    bool done = false;
 
-	while(pixel_removed) {
-		pixel_removed = false;
-		for(int pass_num=1; pass_num<3; ++pass_num) {
-//			int nonzero = 0;
-			passes++;
+    //processes the rows from start to end (exclusive, not counting the zero row above the image)
+    auto skeletonize_band = [&](int start, int end) {
+        uint64_t* curr = curr_start;
+        uint64_t* next = next_start;
+        for(int y=start; y<end; ++y) {
+            const uint8_t* im_row = image + im_stride*y;
+            uint64_t* row = curr + row_words*(y+1);
+            for(int x=0; x<width; ++x) {
+                if(im_row[x]) {
+                    row[(x+1) >> 6] |= uint64_t(1) << ((x+1) & 63);
+                }
+            }
+        }
+        barrier.arrive_and_wait([] {});
 
-			for(int y=1; y<height-1; ++y) {
-				uint8_t* curr_row = curr_skeleton + width*y;
-				uint8_t* next_row = next_skeleton + width*y;
-				for(int x=1; x<width-1; ++x) {
-					const uint8_t* m = curr_row + x;
-					if(*m) {
-//						nonzero++;
-						int neighbors = lut[(m[d+l] << 0) |
-							            (m[d] << 1) |
-		    						    (m[d+r] << 2) |
-			    					    (m[r] << 3) |
-				    				    (m[u+r] << 4) |
-					    			    (m[u] << 5) |
-						    		    (m[u+l] << 6) |
-							    	    (m[l] << 7)];
+        while(!done) {
+            for(int pass_num=1; pass_num<3; ++pass_num) {
+                bool removed_any = false;
+                for(int y=start+1; y<end+1; ++y) {
+                    const uint64_t* up = curr + row_words*(y-1);
+                    const uint64_t* row = curr + row_words*y;
+                    const uint64_t* down = curr + row_words*(y+1);
+                    uint64_t* next_row = next + row_words*y;
+                    for(int w=0; w<words; ++w) {
+                        uint64_t pixels = row[w];
+                        if(!pixels) {
+                            next_row[w] = 0;
+                            continue;
+                        }
+                        uint64_t ul = left_neighbors(up, w), u = up[w], ur = right_neighbors(up, w);
+                        uint64_t l = left_neighbors(row, w), r = right_neighbors(row, w);
+                        uint64_t dl = left_neighbors(down, w), d = down[w], dr = right_neighbors(down, w);
+                        //pixels surrounded by 8 neighbors are never removed, so we only look up the others
+                        uint64_t candidates = pixels & ~(ul & u & ur & l & r & dl & d & dr);
+                        uint64_t removed = 0;
+                        while(candidates) {
+                            int b = lowest_bit(candidates);
+                            candidates &= candidates - 1;
+                            int neighbors = lut[(bit(ul, b) << 0) |
+                                                (bit(u, b) << 1) |
+                                                (bit(ur, b) << 2) |
+                                                (bit(r, b) << 3) |
+                                                (bit(dr, b) << 4) |
+                                                (bit(d, b) << 5) |
+                                                (bit(dl, b) << 6) |
+                                                (bit(l, b) << 7)];
+                            if(neighbors == 3 || neighbors == pass_num) {
+                                removed |= uint64_t(1) << b;
+                            }
+                        }
+                        next_row[w] = pixels & ~removed;
+                        removed_any |= removed != 0;
+                    }
+                }
+                if(removed_any) {
+                    pixel_removed = true;
+                }
+                //the last pass's output is the next pass's input
+                barrier.arrive_and_wait([&] {
+                    if(pass_num == 2) {
+                        done = !pixel_removed;
+                        pixel_removed = false;
+                    }
+                });
+                std::swap(curr, next);
+            }
+        }
 
-						if(neighbors == 3 || neighbors == pass_num) {
-							next_row[x] = 0;
-							pixel_removed = true;
-						}
-					}
-				}
-			}
-			memcpy(curr_skeleton, next_skeleton, width * height);
-//			printf("nonzero: %d\n", nonzero);
-		}
-	}
-    //copy the skeleton to the output buffer
-    for(int y=1; y<height-1; ++y) {
-        for(int x=1; x<width-1; ++x) {
-            skeleton[sk_stride*(y-1) + x-1] = curr_skeleton[width*y + x];
+        //copy the skeleton to the output buffer
+        for(int y=start; y<end; ++y) {
+            uint8_t* sk_row = skeleton + sk_stride*y;
+            const uint64_t* row = curr + row_words*(y+1);
+            for(int x=0; x<width; ++x) {
+                sk_row[x] = bit(row[(x+1) >> 6], (x+1) & 63);
+            }
         }
+    };
+
+    std::vector<std::thread> threads;
+    for(int start=band; start<height; start+=band) {
+        threads.emplace_back(skeletonize_band, start, std::min(height, start+band));
+    }
+    skeletonize_band(0, std::min(height, band));
+    for(auto& t : threads) {
+        t.join();
     }
-    delete [] curr_skeleton;
-	delete [] next_skeleton;
-	//printf("total passes: %d\n", passes);
 }